@@ -0,0 +1,157 @@
+"""Micro-benchmarks for the bot core.
+
+Run with `bin/python benchmark.py dispatch` or `bin/python benchmark.py loop`. Nothing here talks to a
+matrix server or an mqtt broker.
+"""
+import argparse
+import queue
+import re
+import statistics
+import threading
+import time
+
+import main
+
+
+class FakeRoom(object):
+    room_id = '!bench:example.com'
+    canonical_alias = '#bench:example.com'
+
+
+class FakeClient(object):
+    user_id = '@horscht:example.com'
+    rooms = {FakeRoom.room_id: FakeRoom()}
+
+
+def make_bot():
+    bot = main.Bot('https://example.com', 'horscht', '', 'Horscht', '')
+    bot.client = FakeClient()
+    return bot
+
+
+def legacy_dispatch(bot, commands, message):
+    """The linear regex scan handle_message used to do."""
+    for command in commands:
+        match = re.search(command, message, flags=re.IGNORECASE)
+        if match and (match.start() == 0 or re.search(
+                '({}|{})'.format(bot.display_name, bot.username),
+                message, flags=re.IGNORECASE)):
+            return True
+    return False
+
+
+def register_commands(count):
+    main.COMMAND_REGISTRY.clear()
+    for num in range(count):
+        main.COMMAND_REGISTRY['!cmd{:04d}'.format(num)] = \
+            lambda event, command, bot, args, config: None
+    main.build_command_index()
+
+
+def rate(func, messages, seconds):
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for message in messages:
+            func(message)
+        done += len(messages)
+    return done / (time.perf_counter() - start)
+
+
+def bench_dispatch(args):
+    bot = make_bot()
+    event = {'room_id': FakeRoom.room_id, 'sender': '@user:example.com'}
+    for count in (10, 100, 1000):
+        register_commands(count)
+        commands = list(main.COMMAND_REGISTRY)
+        messages = [
+            '!cmd{:04d} some args'.format(count - 1),
+            'Horscht, please !cmd{:04d}'.format(count // 2),
+            'just chatting, nothing to see here',
+        ]
+        new = rate(lambda m: bot.handle_message(event, m), messages,
+                   args.seconds)
+        old = rate(lambda m: legacy_dispatch(bot, commands, m), messages,
+                   args.seconds)
+        print('{:5d} commands: {:10.0f} msg/s (legacy scan: {:10.0f} msg/s)'
+              .format(count, new, old))
+
+
+def legacy_loop(inbox, handle, stop):
+    """The 50 ms polling loop Bot.run used to do."""
+    wakeups = 0
+    while not stop.is_set():
+        wakeups += 1
+        while not inbox.empty():
+            handle(inbox.get_nowait()[1])
+        time.sleep(0.05)
+    return wakeups
+
+
+def event_loop(bot, stop):
+    wakeups = 0
+    while not stop.is_set():
+        wakeups += 1
+        bot.step()
+    return wakeups
+
+
+def measure_loop(run, inbox, samples):
+    """Feeds samples events to the loop, returns its wakeups per second."""
+    stop = threading.Event()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(run(stop)))
+    start = time.perf_counter()
+    thread.start()
+    for num in range(samples):
+        # spread the events so they arrive at random points of a poll
+        time.sleep(0.013 * (num % 7 + 1))
+        inbox.put(('event', {'sent': time.perf_counter()}))
+    time.sleep(0.5)
+    stop.set()
+    # wake the loop up so it notices the stop flag
+    inbox.put(('noop', None))
+    thread.join()
+    return result[0] / (time.perf_counter() - start)
+
+
+def bench_loop(args):
+    samples = max(10, int(args.seconds * 20))
+    bot = make_bot()
+    new_latencies = []
+    bot.handle_event = lambda event: new_latencies.append(
+        time.perf_counter() - event['sent'])
+    new_run = lambda stop: event_loop(bot, stop)
+    measure_loop(new_run, bot.inbox, samples)
+    new_wakeups = measure_loop(new_run, bot.inbox, 0)
+
+    inbox = queue.Queue()
+    old_latencies = []
+    old_run = lambda stop: legacy_loop(
+        inbox, lambda event: old_latencies.append(
+            time.perf_counter() - event['sent']) if event else None, stop)
+    measure_loop(old_run, inbox, samples)
+    old_wakeups = measure_loop(old_run, inbox, 0)
+
+    for name, latencies, wakeups in (
+            ('event-driven', new_latencies, new_wakeups),
+            ('legacy poll', old_latencies, old_wakeups)):
+        print('{:12s}: median {:7.3f} ms, max {:7.3f} ms, {:5.1f} idle wakeups/s'
+              .format(name, statistics.median(latencies) * 1000,
+                      max(latencies) * 1000, wakeups))
+
+
+def main_():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument('--seconds', type=float, default=1.0,
+                           help='How long to run each measurement.')
+    sub = argparser.add_subparsers(dest='benchmark', required=True)
+    sub.add_parser('dispatch', help='Command dispatch throughput.')
+    sub.add_parser('loop', help='Latency from event arrival to handling.')
+    args = argparser.parse_args()
+    {'dispatch': bench_dispatch,
+     'loop': bench_loop}[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main_()
@@ -1,32 +1,67 @@
 from matrix_client.api import MatrixRequestError
 from matrix_client.client import MatrixClient
 import matrix_client.errors
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout
+from urllib3.util.retry import Retry
 import argparse
+import asyncio
+import collections
+import concurrent.futures
 import configparser
+import functools
+import heapq
 import importlib
+import importlib.util
+import itertools
+import json
 import logging
 import os
-import paho.mqtt.client as mqtt
 import queue
+import random
 import re
+import requests
 import sys
+import threading
 import time
 import traceback
 import urllib.parse
 
 log = logging.getLogger(__name__)
+# paho.mqtt.client, imported by make_mqtt_client if a broker is configured
+mqtt = None
 
 COMMAND_REGISTRY = {}
 MESSAGES_REGISTRY = {}
 MESSAGES_CONFIG = {}
+# topic filter trie of the keys of MESSAGES_REGISTRY
+MESSAGE_ROUTES = None
 CRON_REGISTRY = [] 
+# pattern -> function reacting to messages matching it
+TRIGGER_REGISTRY = {}
+TRIGGERS_CONFIG = {}
+TRIGGER_PATTERNS = {}
+# the trigger patterns which can be combined, in one regex, to skip
+# messages matching none of them
+TRIGGER_RE = None
+TRIGGER_COMBINED = []
+# trigger patterns referring to their groups, always tried on their own
+TRIGGER_SEPARATE = []
+# backreferences and conditionals, which break when groups are renumbered
+GROUP_REFERENCE_RE = re.compile(r'\\[1-9]|\\g<|\(\?P=|\(\?\(')
 MODULE_CONFIG = {}
+# command -> name of the config section of its module
+COMMAND_MODULES = {}
+# module section name -> semaphore limiting its concurrently running commands
+MODULE_LIMITS = {}
 
+# command -> frozenset of allowed room addresses/users, None if unrestricted
 ACL_ROOMS = {}
 ACL_USERS = {}
 
-COMMANDS = []
+# casefolded command -> registered command, built once by build_command_index
+COMMAND_INDEX = {}
+TOKEN_RE = re.compile(r'\S+')
 HELP = '''{} reagiert auf folgendes:
 <ul>
 {}
@@ -38,6 +73,38 @@ HELP = '''{} reagiert auf folgendes:
 '''
 HELP_MSGS = []
 HELP_CMDS = []
+# sorted (command, rendered entry) and rendered entries, see build_help
+HELP_CMD_ENTRIES = []
+HELP_MSG_ENTRIES = []
+# (display name, visibility of each command) -> rendered help
+HELP_CACHE = {}
+
+# seconds to wait for the first mqtt connection, and between reconnects
+MQTT_CONNECT_TIMEOUT = 10
+MQTT_RECONNECT_MIN = 1
+MQTT_RECONNECT_MAX = 120
+# tolerance when comparing against deadlines, waits may wake up early
+CLOCK_SLACK = 0.01
+READ_RECEIPT_MODES = ('coalesced', 'immediate', 'off')
+# attempts and exponential backoff (seconds) for failing sends
+SEND_ATTEMPTS = 6
+SEND_BACKOFF = 1
+SEND_BACKOFF_MAX = 60
+# cached acl decisions per room, before the cache of the room is reset
+ACL_CACHE_SIZE = 4096
+MQTT_QUEUE_POLICIES = ('block', 'drop')
+# responses kept by an HttpClient for conditional requests
+HTTP_CACHE_SIZE = 256
+CRON_MISSED_POLICIES = ('skip', 'catchup')
+# at most this many missed runs of a cron job are caught up at once
+CRON_MAX_CATCHUP = 10
+# seconds between logging the intended and actual intervals of cron jobs
+CRON_STATS_INTERVAL = 3600
+# rooms subscribed to topics, see SubscriptionIndex
+SUBSCRIPTIONS_FILE = '.subscriptions'
+# handlers and help texts of the modules, for lazy_modules
+MANIFEST_FILE = '.module_manifest.json'
+MODULE_KINDS = ('CMDS', 'MSGS', 'TRIGGERS')
 
 
 def format_help_entry(cmd, txt):
@@ -50,27 +117,944 @@ def format_help_entry(cmd, txt):
     return out.format(cmd, txt)
 
 
+def build_command_index():
+    """Builds the dispatch index from the registered commands.
+
+    Has to be called after all modules are loaded."""
+    COMMAND_INDEX.clear()
+    for cmd in COMMAND_REGISTRY:
+        COMMAND_INDEX[cmd.casefold()] = cmd
+
+
+def build_message_routes():
+    """Builds the topic trie from the registered MQTT topic filters.
+
+    Has to be called after all modules are loaded."""
+    global MESSAGE_ROUTES
+    MESSAGE_ROUTES = TopicTrie()
+    for topic_filter in MESSAGES_REGISTRY:
+        MESSAGE_ROUTES.add(topic_filter, topic_filter)
+
+
+def build_help():
+    """Renders the help entries once and resets the cache of help texts.
+
+    Has to be called after all modules are (re)loaded."""
+    HELP_CACHE.clear()
+    HELP_CMD_ENTRIES[:] = [(cmd, format_help_entry(cmd, htxt))
+                           for cmd, htxt in sorted(HELP_CMDS)]
+    HELP_MSG_ENTRIES[:] = [format_help_entry(msg, htxt)
+                           for msg, htxt in sorted(HELP_MSGS)]
+
+
+def build_trigger_re():
+    """Combines the registered trigger patterns into TRIGGER_RE.
+
+    Patterns with named groups or references to groups are left out,
+    since combining renumbers the groups. Has to be called after all
+    modules are loaded. Raises re.error if the patterns can not be
+    combined."""
+    global TRIGGER_RE
+    TRIGGER_RE = None
+    TRIGGER_COMBINED[:] = []
+    TRIGGER_SEPARATE[:] = []
+    for pattern, pattern_re in TRIGGER_PATTERNS.items():
+        if pattern_re.groupindex or GROUP_REFERENCE_RE.search(pattern):
+            TRIGGER_SEPARATE.append((pattern, pattern_re))
+        else:
+            TRIGGER_COMBINED.append((pattern, pattern_re))
+    if TRIGGER_COMBINED:
+        TRIGGER_RE = re.compile('|'.join(
+            '(?:{})'.format(pattern) for pattern, _ in TRIGGER_COMBINED),
+            flags=re.IGNORECASE)
+
+
+def trigger_acl_key(pattern):
+    """Returns the key of the acl of a trigger, distinct from commands."""
+    return ('trigger', pattern)
+
+
+def find_command(message, mentioned):
+    """Returns (command, position) of the command spelled in message.
+
+    The command has to be the first word of the message, or, if the bot
+    is mentioned, any word in it. Returns (None, -1) if there is none.
+    mentioned is a bool or a function telling whether the message
+    mentions the bot."""
+    first = TOKEN_RE.search(message)
+    if first is None:
+        return None, -1
+    if first.start() == 0:
+        cmd = COMMAND_INDEX.get(first.group().casefold())
+        if cmd is not None:
+            return cmd, 0
+    if callable(mentioned):
+        mentioned = mentioned(message)
+    if not mentioned:
+        return None, -1
+    for token in TOKEN_RE.finditer(message):
+        cmd = COMMAND_INDEX.get(token.group().casefold())
+        if cmd is not None:
+            return cmd, token.start()
+    return None, -1
+
+
+def retry_after_ms(content, default=1000):
+    """Returns retry_after_ms of the body of a 429 response."""
+    try:
+        return int(json.loads(content).get('retry_after_ms', default))
+    except (TypeError, ValueError, AttributeError):
+        return default
+
+
+def parse_acl(value):
+    """Returns the addresses listed in an allowed_* setting as a frozenset.
+
+    Returns None if the setting is missing, meaning no restriction."""
+    if value is None:
+        return None
+    return frozenset(value.split())
+
+
 def sigterm_handler(_signo, _stack_frame):
     """Raises SystemExit(0), causing everything to cleanly shut down."""
     sys.exit(0)
 
 
+def make_mqtt_client(client_id):
+    """Returns an mqtt client with a persistent session.
+
+    Messages published while we are briefly disconnected are kept by the
+    broker for the session of client_id."""
+    global mqtt
+    import paho.mqtt.client as mqtt
+    if hasattr(mqtt, 'CallbackAPIVersion'):
+        # paho-mqtt >= 2.0, keep the callback signatures of 1.x
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1,
+                           client_id=client_id, clean_session=False)
+    return mqtt.Client(client_id=client_id, clean_session=False)
+
+
+def module_stamp(module):
+    """Returns [path, mtime, size] of the source of module, or None."""
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+        return None
+    stat = os.stat(spec.origin)
+    return [spec.origin, stat.st_mtime_ns, stat.st_size]
+
+
+def describe_module(mod, stamp):
+    """Returns the manifest entry of mod: its handlers' keys and help."""
+    entry = {'stamp': stamp}
+    for kind in MODULE_KINDS:
+        if hasattr(mod, kind):
+            entry[kind] = {key: [func.__doc__,
+                                 asyncio.iscoroutinefunction(func)]
+                           for key, func in getattr(mod, kind).items()}
+    if hasattr(mod, 'CRON'):
+        entry['CRON'] = [mod.CRON.__doc__,
+                         asyncio.iscoroutinefunction(mod.CRON)]
+    return entry
+
+
+def lazy_handler(module, kind, key, doc, is_async):
+    """Returns a function which imports module and calls its handler."""
+    resolved = []
+
+    def resolve():
+        if not resolved:
+            started = time.perf_counter()
+            handlers = getattr(importlib.import_module(module), kind)
+            resolved.append(handlers if key is None else handlers[key])
+            log.debug('Resolved %s of %s in %.1f ms', key or kind, module,
+                      (time.perf_counter() - started) * 1000)
+        return resolved[0]
+
+    if is_async:
+        async def handler(*args):
+            return await resolve()(*args)
+    else:
+        def handler(*args):
+            return resolve()(*args)
+    handler.__doc__ = doc
+    return handler
+
+
+class LazyModule(object):
+    """Stands in for a module listed in the manifest.
+
+    Has the module's CMDS, MSGS, TRIGGERS and CRON, whose handlers import
+    the module when they are first called."""
+    def __init__(self, name, entry):
+        self.__name__ = name
+        for kind in MODULE_KINDS:
+            if kind in entry:
+                setattr(self, kind, {
+                    key: lazy_handler(name, kind, key, doc, is_async)
+                    for key, (doc, is_async) in entry[kind].items()})
+        if 'CRON' in entry:
+            self.CRON = lazy_handler(name, 'CRON', None, *entry['CRON'])
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, 'r') as manifest:
+            return json.load(manifest)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    tmp = MANIFEST_FILE + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, MANIFEST_FILE)
+    except IOError:
+        log.exception('Could not save %s', MANIFEST_FILE)
+
+
+def load_module(module, manifest=None):
+    """Imports module, or with a manifest, returns a LazyModule for it if
+    the manifest knows its current version.
+
+    Adds the entry of the module to the manifest."""
+    if manifest is None:
+        return importlib.import_module(module)
+    stamp = module_stamp(module)
+    entry = manifest.get(module)
+    if stamp is not None and entry is not None and entry['stamp'] == stamp:
+        return LazyModule(module, entry)
+    mod = importlib.import_module(module)
+    manifest[module] = describe_module(mod, stamp)
+    return mod
+
+
 def subscribe_to_topics(client, userdata, flags, rc):
-    time.sleep(1)
-    for topic in MESSAGES_REGISTRY.keys():
-        client.subscribe(topic)
+    topics = [(topic, 1) for topic in MESSAGES_REGISTRY.keys()]
+    if topics:
+        client.subscribe(topics)
+
+
+class TopicTrie(object):
+    """Maps MQTT topic filters, which may contain + and # wildcards, to
+    values and finds the values of all filters matching a topic."""
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+    def add(self, topic_filter, value):
+        node = self
+        for level in topic_filter.split('/'):
+            node = node.children.setdefault(level, TopicTrie())
+        node.values.append(value)
+
+    def match(self, topic):
+        """Returns the values of all filters matching topic."""
+        levels = topic.split('/')
+        # wildcards at the first level do not match topics starting with $
+        system = topic.startswith('$')
+        found = []
+        nodes = [(self, 0)]
+        while nodes:
+            node, depth = nodes.pop()
+            wildcards = not (system and depth == 0)
+            multi = node.children.get('#')
+            if multi is not None and wildcards:
+                found.extend(multi.values)
+            if depth == len(levels):
+                found.extend(node.values)
+                continue
+            child = node.children.get(levels[depth])
+            if child is not None:
+                nodes.append((child, depth + 1))
+            single = node.children.get('+')
+            if single is not None and wildcards:
+                nodes.append((single, depth + 1))
+        return found
+
+class OrderedExecutor(object):
+    """Runs tasks on a thread pool.
+
+    Tasks submitted with the same key run one after another in the order
+    they were submitted, tasks with different keys run in parallel."""
+    def __init__(self, workers):
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='handler')
+        self.lock = threading.Lock()
+        # key -> tasks waiting for the running task of that key
+        self.pending = {}
+        # key of the task running in this thread, and whether it deferred
+        self.local = threading.local()
+
+    def submit(self, key, func, *args):
+        with self.lock:
+            if key in self.pending:
+                self.pending[key].append((func, args))
+                return
+            self.pending[key] = collections.deque()
+        self.pool.submit(self._run, key, func, args)
+
+    def defer(self):
+        """Keeps the key of the running task busy after the task returns.
+
+        Returns a function, which is to be called with func and args
+        tuple of the task to continue the key with. Only the tasks after
+        that one are started."""
+        self.local.deferred = True
+        return functools.partial(self.pool.submit, self._run, self.local.key)
+
+    def _run(self, key, func, args):
+        self.local.key = key
+        self.local.deferred = False
+        try:
+            func(*args)
+        except Exception:
+            log.exception('Error while handling task for %s', key)
+        if self.local.deferred:
+            return
+        with self.lock:
+            waiting = self.pending[key]
+            if not waiting:
+                del self.pending[key]
+                return
+            func, args = waiting.popleft()
+        self.pool.submit(self._run, key, func, args)
+
+
+class ModuleLimit(object):
+    """Limits how many commands of a module run at the same time.
+
+    Commands over the limit do not wait in a thread, they are parked
+    and started when a running one finishes."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.running = 0
+        # functions starting the parked commands
+        self.parked = collections.deque()
+
+    def acquire(self, park):
+        """Returns True if a command may run now.
+
+        Otherwise calls park, which returns a function that starts the
+        command later, and returns False. The started command owns the
+        slot and has to release it."""
+        with self.lock:
+            if self.running < self.limit:
+                self.running += 1
+                return True
+            self.parked.append(park())
+            return False
+
+    def release(self):
+        with self.lock:
+            if not self.parked:
+                self.running -= 1
+                return
+            # the slot goes over to the parked command
+            start = self.parked.popleft()
+        start()
+
+
+class ReceiptSender(object):
+    """Sends read receipts from a background thread.
+
+    Receipts are collected for interval seconds, then only the newest
+    event of each room is acknowledged."""
+    def __init__(self, send, interval):
+        self.send = send
+        self.interval = interval
+        self.lock = threading.Lock()
+        # room id -> newest event id not yet acknowledged
+        self.latest = {}
+        self.pending = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name='receipts', daemon=True)
+        self.thread.start()
+
+    def mark_read(self, room_id, event_id):
+        with self.lock:
+            self.latest[room_id] = event_id
+        self.pending.set()
+
+    def flush(self):
+        with self.lock:
+            latest, self.latest = self.latest, {}
+            self.pending.clear()
+        for room_id, event_id in latest.items():
+            try:
+                self.send(room_id, event_id)
+            except Exception:
+                log.exception('Failed to send read receipt to %s', room_id)
+
+    def _run(self):
+        while True:
+            self.pending.wait()
+            time.sleep(self.interval)
+            self.flush()
+
+
+class CronJob(object):
+    """A CRON function of a module, run every interval seconds."""
+    def __init__(self, module_name, func, interval, missed='skip', jitter=0,
+                 timeout=None):
+        self.module_name = module_name
+        self.func = func
+        self.interval = interval
+        self.missed = missed
+        self.jitter = jitter
+        self.timeout = interval if timeout is None else timeout
+        self.lock = threading.Lock()
+        self.running = self.timed_out = False
+        self.started = None
+        self.timeouts = 0
+        # runs are scheduled on a fixed grid, jitter is added on top
+        self.next_run = None
+        self.last_run = None
+        self.runs = self.skipped = 0
+        self.interval_avg = self.interval_max = 0
+
+    def record_run(self, now):
+        """Keeps track of the actual interval between runs."""
+        if self.last_run is not None:
+            actual = now - self.last_run
+            self.interval_avg += (actual - self.interval_avg) / min(
+                self.runs, 10)
+            self.interval_max = max(self.interval_max, actual)
+            if actual > self.interval + self.jitter + 1:
+                log.warning('Cron plugin %s ran %.1f s after its last run, '
+                            'intended every %g s.', self.module_name, actual,
+                            self.interval)
+        self.last_run = now
+        self.runs += 1
+
+    def try_start(self, now):
+        """Marks the job as running, unless its last run is still going."""
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.timed_out = False
+            self.started = now
+            return True
+
+    def check_timeout(self, now):
+        """Counts the running job as timed out once it exceeds its timeout."""
+        with self.lock:
+            if not self.running or self.timed_out or \
+                    now - self.started <= self.timeout:
+                return
+            self.timed_out = True
+            self.timeouts += 1
+        log.error('Cron plugin %s is running for %.1f s, longer than its '
+                  'timeout of %g s.', self.module_name, now - self.started,
+                  self.timeout)
+
+    def finish(self, now):
+        self.check_timeout(now)
+        with self.lock:
+            self.running = False
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'interval_avg': self.interval_avg,
+            'interval_max': self.interval_max,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'timeouts': self.timeouts,
+        }
+
+
+class Scheduler(object):
+    """Keeps the cron jobs in a heap ordered by their next run."""
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.heap = []
+        self.seq = itertools.count()
+        self.stats_due = None
+
+    def start(self, now):
+        self.heap = []
+        self.stats_due = now + CRON_STATS_INTERVAL
+        for job in self.jobs:
+            job.next_run = now + job.interval
+            self._push(job)
+
+    def _push(self, job):
+        deadline = job.next_run + random.uniform(0, job.jitter)
+        heapq.heappush(self.heap, (deadline, next(self.seq), job))
+
+    def next_deadline(self):
+        """Returns the monotonic time the next job is due, or None."""
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """Returns (job, runs) for every job due at now, rescheduling them.
+
+        runs is more than 1 if the job missed runs and should catch up."""
+        due = []
+        while self.heap and self.heap[0][0] <= now + CLOCK_SLACK:
+            job = heapq.heappop(self.heap)[2]
+            missed = max(0, int((now - job.next_run) // job.interval))
+            job.next_run += (missed + 1) * job.interval
+            runs = 1
+            if job.missed == 'catchup':
+                runs += min(missed, CRON_MAX_CATCHUP)
+            job.skipped += missed + 1 - runs
+            due.append((job, runs))
+            self._push(job)
+        if self.stats_due is not None and now >= self.stats_due:
+            self.stats_due = now + CRON_STATS_INTERVAL
+            self.log_stats()
+        return due
+
+    def log_stats(self):
+        for module_name, stats in self.stats().items():
+            log.info('Cron plugin %s: every %.1f s intended, %.1f s on '
+                     'average, %.1f s at most; %d runs, %d skipped, '
+                     '%d timed out.', module_name, stats['interval'],
+                     stats['interval_avg'], stats['interval_max'],
+                     stats['runs'], stats['skipped'], stats['timeouts'])
+
+    def stats(self):
+        """Returns the stats of every job, by module name."""
+        return {job.module_name: job.stats() for job in self.jobs}
+
+
+class HttpClient(object):
+    """Pooled HTTP client for modules, see Bot.http_client.
+
+    Keeps connections to each host alive, applies a default timeout and
+    retries failed requests with exponential backoff. With cache set,
+    GET responses carrying an ETag or Last-Modified header are kept and
+    revalidated with conditional requests."""
+    def __init__(self, timeout=10, retries=3, backoff=0.5, pool_size=10,
+                 cache=False):
+        self.settings = {'timeout': timeout, 'retries': retries,
+                         'backoff': backoff, 'pool_size': pool_size,
+                         'cache': cache}
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      respect_retry_after_header=True)
+        # one pool of pool_size connections per host
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        # (url, authorization) -> (etag, last modified, response)
+        self.responses = collections.OrderedDict()
+
+    @classmethod
+    def from_config(klass, section, defaults=None):
+        """Creates a client from the http_* settings of a config section."""
+        return klass(**klass.settings_from_config(section, defaults))
+
+    @staticmethod
+    def settings_from_config(section, defaults=None):
+        """Returns the http_* settings of a config section as a dict."""
+        settings = dict(defaults or {})
+        for key, get in (('timeout', section.getfloat),
+                         ('retries', section.getint),
+                         ('backoff', section.getfloat),
+                         ('pool_size', section.getint),
+                         ('cache', section.getboolean)):
+            value = get('http_' + key, None)
+            if value is not None:
+                settings[key] = value
+        return settings
+
+    def request(self, method, url, **kw):
+        kw.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kw)
+
+    def get(self, url, **kw):
+        if not self.cache:
+            return self.request('GET', url, **kw)
+        headers = dict(kw.pop('headers', None) or {})
+        key = (requests.Request('GET', url, params=kw.get('params'))
+               .prepare().url, headers.get('Authorization'))
+        with self.lock:
+            cached = self.responses.get(key)
+        if cached is not None:
+            etag, last_modified, response = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        response = self.request('GET', url, headers=headers, **kw)
+        if response.status_code == 304 and cached is not None:
+            return cached[2]
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.ok and (etag or last_modified):
+            with self.lock:
+                self.responses[key] = (etag, last_modified, response)
+                self.responses.move_to_end(key)
+                if len(self.responses) > HTTP_CACHE_SIZE:
+                    self.responses.popitem(last=False)
+        return response
+
+    def post(self, url, **kw):
+        return self.request('POST', url, **kw)
+
+
+class OutgoingMessage(object):
+    """A message waiting in the Outbox."""
+    def __init__(self, room_id, send):
+        self.room_id = room_id
+        self.send = send
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+
+class Outbox(object):
+    """Sends messages from background threads, one queue per room.
+
+    Messages of a room are sent in order, different rooms are served by
+    up to `workers` threads. Rate limits of the server are honoured, other
+    failures are retried with exponential backoff."""
+    def __init__(self, workers=2):
+        self.cond = threading.Condition()
+        # room id -> messages waiting to be sent
+        self.queues = {}
+        # (due, seq, room id) of rooms with messages and no sending worker
+        self.ready = []
+        self.seq = itertools.count()
+        # the server asked us to wait with all messages until then
+        self.paused_until = 0
+        self.sent = self.retried = self.dropped = 0
+        self.latency_avg = self.latency_max = 0
+        for num in range(workers):
+            threading.Thread(target=self._run, name='outbox-{}'.format(num),
+                             daemon=True).start()
+
+    def put(self, room_id, send):
+        """Queues the callable send, which sends a message to room_id."""
+        with self.cond:
+            waiting = self.queues.setdefault(room_id, collections.deque())
+            waiting.append(OutgoingMessage(room_id, send))
+            if len(waiting) == 1:
+                heapq.heappush(self.ready, (0, next(self.seq), room_id))
+                self.cond.notify()
+
+    def depth(self):
+        """Returns the number of messages waiting to be sent."""
+        with self.cond:
+            return sum(len(waiting) for waiting in self.queues.values())
+
+    def stats(self):
+        """Returns counters, queue depth and send latency (in seconds)."""
+        with self.cond:
+            return {
+                'depth': sum(len(waiting) for waiting in self.queues.values()),
+                'rooms': len(self.queues),
+                'sent': self.sent,
+                'retried': self.retried,
+                'dropped': self.dropped,
+                'latency_avg': self.latency_avg,
+                'latency_max': self.latency_max,
+            }
+
+    def _next(self):
+        """Waits for a room which is due and returns its oldest message."""
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                due = max(self.ready[0][0], self.paused_until) \
+                    if self.ready else None
+                if due is not None and due <= now:
+                    room_id = heapq.heappop(self.ready)[2]
+                    return self.queues[room_id][0]
+                self.cond.wait(None if due is None else due - now)
+
+    def _done(self, message, retry_in=None):
+        """Removes message from its queue, unless it should be retried."""
+        with self.cond:
+            waiting = self.queues[message.room_id]
+            due = 0
+            if retry_in is None:
+                waiting.popleft()
+            else:
+                due = time.monotonic() + retry_in
+            if waiting:
+                heapq.heappush(self.ready, (due, next(self.seq), message.room_id))
+                self.cond.notify()
+            else:
+                del self.queues[message.room_id]
+
+    def _run(self):
+        while True:
+            message = self._next()
+            message.attempts += 1
+            try:
+                message.send()
+            except MatrixRequestError as e:
+                if e.code == 429:
+                    # matrix_client usually waits out 429s by itself
+                    retry_after = retry_after_ms(e.content) / 1000
+                    log.warning('Rate limited, pausing sends for %.1f s, '
+                                '%d messages queued.', retry_after, self.depth())
+                    with self.cond:
+                        self.paused_until = max(
+                            self.paused_until, time.monotonic() + retry_after)
+                        self.retried += 1
+                    # does not count as a failed attempt
+                    message.attempts -= 1
+                    self._done(message, retry_in=0)
+                elif e.code >= 500:
+                    self._retry(message, e)
+                else:
+                    log.error('Failed to send message to %s: %s',
+                              message.room_id, e)
+                    self._drop(message)
+            except (matrix_client.errors.MatrixHttpLibError,
+                    ConnectionError, Timeout) as e:
+                self._retry(message, e)
+            except Exception:
+                log.exception('Failed to send message to %s', message.room_id)
+                self._drop(message)
+            else:
+                latency = time.monotonic() - message.queued_at
+                with self.cond:
+                    self.sent += 1
+                    self.latency_avg += (latency - self.latency_avg) / 10
+                    self.latency_max = max(self.latency_max, latency)
+                self._done(message)
+                log.debug('Sent message to %s after %.3f s, %d queued.',
+                          message.room_id, latency, self.depth())
+
+    def _retry(self, message, error):
+        if message.attempts >= SEND_ATTEMPTS:
+            log.error('Giving up sending message to %s after %d attempts: %s',
+                      message.room_id, message.attempts, error)
+            self._drop(message)
+            return
+        backoff = min(SEND_BACKOFF * 2 ** (message.attempts - 1),
+                      SEND_BACKOFF_MAX)
+        log.warning('Failed to send message to %s (%s), retrying in %g s.',
+                    message.room_id, error, backoff)
+        with self.cond:
+            self.retried += 1
+        self._done(message, retry_in=backoff)
+
+    def _drop(self, message):
+        with self.cond:
+            self.dropped += 1
+        self._done(message)
+
+
+class SubscriptionIndex(object):
+    """The rooms subscribed to each topic, persisted in a json file.
+
+    The file maps each topic to a list of room ids. It is read on first
+    use and replaced atomically on every change."""
+    def __init__(self, path=SUBSCRIPTIONS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        # topic -> set of room ids
+        self.topics = None
+
+    def load(self):
+        if self.topics is not None:
+            return
+        topics = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as subfile:
+                    subs = json.load(subfile)
+                if not isinstance(subs, dict):
+                    raise ValueError('not a json object')
+            except ValueError:
+                # do not go on with an empty index, the next change would
+                # overwrite the file
+                log.critical('%s is corrupt, fix or remove it.', self.path)
+                raise
+            for topic, rooms in subs.items():
+                if isinstance(rooms, list) and rooms:
+                    topics[topic] = set(rooms)
+        self.topics = topics
+
+    def save(self):
+        subs = {topic: sorted(rooms) for topic, rooms in self.topics.items()}
+        # in the same directory, so the rename is atomic
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as subfile:
+            json.dump(subs, subfile)
+            subfile.flush()
+            os.fsync(subfile.fileno())
+        os.replace(tmp, self.path)
+
+    def subscribe(self, topic, room_id):
+        """Subscribes room_id to topic, returns False if it already was."""
+        with self.lock:
+            self.load()
+            rooms = self.topics.setdefault(topic, set())
+            if room_id in rooms:
+                return False
+            rooms.add(room_id)
+            self.save()
+            return True
+
+    def unsubscribe(self, topic, room_id):
+        """Unsubscribes room_id from topic, returns False if it was not."""
+        with self.lock:
+            self.load()
+            rooms = self.topics.get(topic, set())
+            if room_id not in rooms:
+                return False
+            rooms.discard(room_id)
+            if not rooms:
+                del self.topics[topic]
+            self.save()
+            return True
+
+    def rooms(self, topic):
+        """Returns the ids of the rooms subscribed to topic."""
+        with self.lock:
+            self.load()
+            return frozenset(self.topics.get(topic, ()))
+
+    def subscribed(self, room_id):
+        """Returns the topics room_id is subscribed to."""
+        with self.lock:
+            self.load()
+            return sorted(topic for topic, rooms in self.topics.items()
+                          if room_id in rooms)
+
+
+class RoomDirectory(object):
+    """Finds joined rooms by room id, canonical alias or display name.
+
+    The names of a room are computed when its state changes instead of on
+    every lookup, which matters for rooms without a name, whose display
+    name matrix_client derives from the member list."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # room id -> room
+        self.rooms = {}
+        # room id -> (display name, canonical alias) it is indexed under
+        self.keys = {}
+        # canonical alias -> room id
+        self.aliases = {}
+        # casefolded display name -> room ids
+        self.names = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def rebuild(self, rooms):
+        """Indexes rooms, forgetting all others."""
+        with self.lock:
+            self.rooms.clear()
+            self.keys.clear()
+            self.aliases.clear()
+            self.names.clear()
+        for room in rooms:
+            self.update(room)
+
+    def update(self, room):
+        """(Re-)indexes room after its name, alias or members changed."""
+        try:
+            name = room.display_name
+        except Exception:
+            log.exception('Could not get display name of %s', room.room_id)
+            name = None
+        alias = room.canonical_alias
+        with self.lock:
+            self._remove(room.room_id)
+            self.rooms[room.room_id] = room
+            self.keys[room.room_id] = (name, alias)
+            if alias:
+                self.aliases[alias] = room.room_id
+            if name:
+                self.names[name.casefold()].add(room.room_id)
+
+    def remove(self, room_id):
+        """Forgets the room, e.g. after the bot left it."""
+        with self.lock:
+            self._remove(room_id)
+
+    def _remove(self, room_id):
+        self.rooms.pop(room_id, None)
+        name, alias = self.keys.pop(room_id, (None, None))
+        if alias and self.aliases.get(alias) == room_id:
+            del self.aliases[alias]
+        if name:
+            room_ids = self.names[name.casefold()]
+            room_ids.discard(room_id)
+            if not room_ids:
+                del self.names[name.casefold()]
+
+    def get(self, key):
+        """Returns the room with key as id, alias or display name, or None."""
+        with self.lock:
+            room = self.rooms.get(key)
+            if room is None and key in self.aliases:
+                room = self.rooms[self.aliases[key]]
+            if room is None:
+                for room_id in self.names.get(key.casefold(), ()):
+                    if self.keys[room_id][0] == key:
+                        room = self.rooms[room_id]
+                        break
+            return room
+
+    def named(self, name, ignore_case=False):
+        """Returns all rooms with the display name name."""
+        with self.lock:
+            return [self.rooms[room_id]
+                    for room_id in self.names.get(name.casefold(), ())
+                    if ignore_case or self.keys[room_id][0] == name]
+
 
 class Bot(object):
     """Handles everything that the bot does."""
-    def __init__(self, server, username, password, display_name, mqtt_broker):
+    def __init__(self, server, username, password, display_name, mqtt_broker,
+                 workers=0, read_receipts='coalesced', receipt_interval=1,
+                 send_workers=2, mqtt_queue_size=1000, mqtt_queue_policy='block',
+                 mqtt_client_id='horscht', http=None):
         self.client = None
         self.server = server
         self.username = username
         self.password = password
         self.display_name = display_name
         self.mqtt_broker = mqtt_broker
-        self.event_queue = queue.Queue()
-        self.invite_queue = queue.Queue()
+        # matrix events and invites, handled in the order they arrive
+        self.inbox = queue.Queue()
+        self.scheduler = Scheduler(CRON_REGISTRY)
+        # room id -> (command, user) -> whether the user may use it there
+        self.acl_cache = {}
+        self.workers = workers
+        # handle events on a thread pool instead of the main loop
+        self.executor = OrderedExecutor(workers) if workers > 0 else None
+        self.outbox = Outbox(send_workers)
+        self.subscriptions = SubscriptionIndex()
+        self.directory = RoomDirectory()
+        # mqtt messages handed over from paho's network thread
+        self.mqtt_inbox = queue.Queue(maxsize=mqtt_queue_size)
+        self.mqtt_queue_policy = mqtt_queue_policy
+        self.mqtt_client_id = mqtt_client_id
+        self.http = http or HttpClient()
+        # http settings of a module section -> client using them
+        self.http_clients = {}
+        self.mqtt_handler_thread = None
+        self.mqtt_received_count = self.mqtt_dropped = self.mqtt_max_depth = 0
+        self.read_receipts = read_receipts
+        self.receipts = None
+        if read_receipts == 'coalesced':
+            self.receipts = ReceiptSender(
+                self.post_read_receipt, receipt_interval)
+        names = '|'.join(re.escape(name) for name in (display_name, username))
+        self.mention_re = re.compile(names, flags=re.IGNORECASE)
 
     def login(self):
         """Logs onto the server."""
@@ -78,94 +1062,153 @@ class Bot(object):
         client.login(
             self.username, self.password, sync=True, device_id='h0rsCHt')
         self.client = client
+        client.add_leave_listener(
+            lambda room_id, room: self.directory.remove(room_id))
 
     def send_html(self, room, msg):
-        try:
-            room.send_html(msg)
-        except (matrix_client.errors.MatrixHttpLibError, matrix_client.errors.MatrixRequestError):
-            log.error('Failed to send {} to {}. Maybe got disconnected, trying to re-connect.')
-            self.login()
-            room.send_html(msg)
+        """Queues msg to be sent to room."""
+        self.outbox.put(room.room_id, functools.partial(room.send_html, msg))
+
+    def broadcast(self, topic, msg):
+        """Queues msg to be sent to all rooms subscribed to topic.
+
+        The rooms are sent to in parallel by the outbox threads."""
+        for room_id in self.subscriptions.rooms(topic):
+            room = self.client.rooms.get(room_id)
+            if room is None:
+                log.debug('Not in subscribed room %s, skipping.', room_id)
+                continue
+            self.send_html(room, msg)
+
+    def message_handlers(self, topic):
+        """Yields (handler, config) of all topic filters matching topic."""
+        for topic_filter in MESSAGE_ROUTES.match(topic):
+            yield (MESSAGES_REGISTRY[topic_filter],
+                   MESSAGES_CONFIG[topic_filter])
 
     def mqtt_received(self, client, data, message):
-        handler = MESSAGES_REGISTRY.get(message.topic)
-        config = MESSAGES_CONFIG.get(message.topic)
-        if handler is None:
-            return
-        handler(message, data, client, self, config)
+        """Hands the message over to the mqtt handler thread.
+
+        Called in paho's network thread, which must not be held up."""
+        self.mqtt_received_count += 1
+        item = (client, data, message)
+        if self.mqtt_queue_policy == 'block':
+            self.mqtt_inbox.put(item)
+        else:
+            try:
+                self.mqtt_inbox.put_nowait(item)
+            except queue.Full:
+                self.mqtt_dropped += 1
+                log.warning('MQTT queue full, dropped message on %s '
+                            '(%d dropped so far).', message.topic,
+                            self.mqtt_dropped)
+                return
+        depth = self.mqtt_inbox.qsize()
+        if depth > self.mqtt_max_depth:
+            self.mqtt_max_depth = depth
+            if depth >= 10:
+                log.info('MQTT queue reached %d messages.', depth)
+
+    def handle_mqtt_messages(self):
+        """Runs the handlers of queued mqtt messages, forever."""
+        while True:
+            client, data, message = self.mqtt_inbox.get()
+            for handler, config in self.message_handlers(message.topic):
+                try:
+                    handler(message, data, client, self, config)
+                except Exception:
+                    log.exception('Error handling mqtt message on %s',
+                                  message.topic)
+
+    def mqtt_stats(self):
+        """Returns counters and depth of the mqtt handoff queue."""
+        return {
+            'depth': self.mqtt_inbox.qsize(),
+            'max_depth': self.mqtt_max_depth,
+            'received': self.mqtt_received_count,
+            'dropped': self.mqtt_dropped,
+        }
 
 
     def connect_mqtt(self):
+        """Connects to the mqtt broker.
+
+        paho's network thread keeps the connection up afterwards, it
+        reconnects with exponential backoff and resumes the persistent
+        session. Returns whether the first connection attempt succeeded
+        within MQTT_CONNECT_TIMEOUT seconds."""
+        if not self.mqtt_broker:
+            return True  # no MQTT broker configured is not an error
+        if self.mqtt_handler_thread is None:
+            self.mqtt_handler_thread = threading.Thread(
+                target=self.handle_mqtt_messages, name='mqtt-handler',
+                daemon=True)
+            self.mqtt_handler_thread.start()
         logging.info("connecting to mqtt server")
-        if self.mqtt_broker:
-            mqtt_client = mqtt.Client(client_id='horscht')
-            
-            # Set up connection tracking
-            connection_result = {'connected': False, 'error': None}
-            
-            def on_connect_callback(client, userdata, flags, rc):
-                if rc == 0:
-                    connection_result['connected'] = True
-                    subscribe_to_topics(client, userdata, flags, rc)
-                else:
-                    connection_result['error'] = f"Connection failed with code {rc}"
-            
-            def on_disconnect_callback(client, userdata, rc):
-                if rc != 0:
-                    logging.warning(f"MQTT disconnected unexpectedly: {rc}")
-                self.reconnect_mqtt(client, userdata, rc)
-            
-            mqtt_client.on_connect = on_connect_callback
-            mqtt_client.on_disconnect = on_disconnect_callback
-            
-            if hasattr(self, 'mqtt_client'):
-                del self.mqtt_client
-            self.mqtt_client = mqtt_client
-            self.mqtt_client.enable_logger(logger=log)
-            
-            try:
-                self.mqtt_client.connect(self.mqtt_broker)
-                self.mqtt_client.loop_start()
-                
-                # Wait up to 10 seconds for connection
-                import time
-                for i in range(5):  # 10 seconds with 2s intervals
-                    if connection_result['connected']:
-                        break
-                    if connection_result['error']:
-                        logging.error(f'MQTT connect failed: {connection_result["error"]}')
-                        return False
-                    time.sleep(2)
-                
-                if not connection_result['connected']:
-                    logging.error('MQTT connect timeout - broker may be unreachable')
-                    return False
-                
-                self.mqtt_client.on_message = self.mqtt_received
-                logging.info('mqtt connected.')
-                return True
-                
-            except Exception as e:
-                logging.error(f'MQTT connect failed: {e}')
-                return False
-        return True  # Return True if no MQTT broker configured (not an error)
-
-    def reconnect_mqtt(self, *args, **kw):
-        """Will get called when mqtt disconnects."""
-        # is_connected seems to return true still, even if the mqtt
-        # server is down
-        logging.error('Mqtt disconneted, trying to reconnect.')
-        #if self.mqtt_client.is_connected():
-        # just make extra sure we are disconnected
-        self.mqtt_client.disconnect()
-        time.sleep(1)
-        self.connect_mqtt()
+        connected = threading.Event()
+
+        def on_connect_callback(client, userdata, flags, rc):
+            if rc != 0:
+                logging.error(f'MQTT connect failed with code {rc}')
+                return
+            logging.info('mqtt connected.')
+            subscribe_to_topics(client, userdata, flags, rc)
+            connected.set()
+
+        def on_disconnect_callback(client, userdata, rc):
+            if rc != 0:
+                logging.warning(f"MQTT disconnected unexpectedly: {rc}, "
+                                "reconnecting.")
+
+        mqtt_client = make_mqtt_client(self.mqtt_client_id)
+        mqtt_client.on_connect = on_connect_callback
+        mqtt_client.on_disconnect = on_disconnect_callback
+        mqtt_client.on_message = self.mqtt_received
+        mqtt_client.reconnect_delay_set(MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX)
+        mqtt_client.enable_logger(logger=log)
+        self.mqtt_client = mqtt_client
+        mqtt_client.connect_async(self.mqtt_broker)
+        mqtt_client.loop_start()
+
+        if not connected.wait(MQTT_CONNECT_TIMEOUT):
+            logging.error('MQTT connect timeout - broker may be unreachable')
+            mqtt_client.loop_stop()
+            return False
+        return True
+
+    def http_client(self, config=None):
+        """Returns the shared HTTP client for a module.
+
+        Modules can tune it with http_timeout, http_retries, http_backoff,
+        http_pool_size and http_cache in their config section. Modules
+        with the same settings share a client and its connections."""
+        if config is None or not any(key.startswith('http_')
+                                     for key in config):
+            return self.http
+        settings = HttpClient.settings_from_config(config, self.http.settings)
+        key = tuple(sorted(settings.items()))
+        client = self.http_clients.get(key)
+        if client is None:
+            client = self.http_clients.setdefault(key, HttpClient(**settings))
+        return client
 
     def get_room(self, event):
         """Returns the room the given event took place in."""
         return self.client.rooms[event['room_id']]
 
     def command_allowed(self, cmd, user, room):
+        """Returns whether user may use cmd in room.
+
+        Decisions are cached per room until its canonical alias changes."""
+        decisions = self.acl_cache.setdefault(room.room_id, {})
+        allowed = decisions.get((cmd, user))
+        if allowed is None:
+            if len(decisions) >= ACL_CACHE_SIZE:
+                decisions.clear()
+            allowed = decisions[(cmd, user)] = self.check_acl(cmd, user, room)
+        return allowed
+
+    def check_acl(self, cmd, user, room):
         # canonical alias not set always, maybe its a private conversation
         # then we check against the room id.
         room_address = room.canonical_alias or room.room_id
@@ -197,31 +1240,46 @@ class Bot(object):
         if command is None:
             return
 
-        if self.command_allowed(cmd, event['sender'], room):
-            command(event, command, self, args, MODULE_CONFIG)
+        if not self.command_allowed(cmd, event['sender'], room):
+            return
+        module_name = COMMAND_MODULES.get(cmd)
+        config = MODULE_CONFIG.get(module_name)
+        limit = MODULE_LIMITS.get(module_name)
+        if limit is None or self.executor is None:
+            # without workers, commands run one at a time anyway
+            command(event, command, self, args, config)
+            return
+
+        def run():
+            try:
+                command(event, command, self, args, config)
+            finally:
+                limit.release()
+
+        # over the limit, the room's later events wait with the command,
+        # but no worker thread does
+        if limit.acquire(lambda: functools.partial(
+                self.executor.defer(), run, ())):
+            run()
 
     def reply(self, event, message, html=False):
         """Replies to the given event with the provided message."""
         room = self.get_room(event)
         logging.info("Reply: %s" % message)
-        if html:
-            room.send_html(message)
-        else:
-            room.send_text(message)
+        send = room.send_html if html else room.send_text
+        self.outbox.put(room.room_id, functools.partial(send, message))
 
     def is_name_in_message(self, message):
         """Returns whether the message contains the bot's name.
 
         Considers both display name and username.
         """
-        regex = "({}|{})".format(
-            self.display_name, self.username)
-        return re.search(regex, message, flags=re.IGNORECASE)
+        return self.mention_re.search(message)
 
     def handle_invite(self, room_id, invite_state):
         # join rooms if invited
         try:
-            self.client.join_room(room_id)
+            self.directory.update(self.client.join_room(room_id))
             logging.info('Joined room: %s' % room_id)
         except MatrixRequestError as e:
             if e.code == 404:
@@ -234,58 +1292,107 @@ class Bot(object):
     def get_help(self, event):
         user = event['sender']
         room = self.get_room(event)
-        help_commands = []
-        for cmd, htxt in sorted(HELP_CMDS):
-            if self.command_allowed(cmd, event['sender'], room):
-                help_commands.append(format_help_entry(cmd, htxt))
-        help_messages = []
-        for msg, htxt in sorted(HELP_MSGS):
-            help_messages.append(format_help_entry(msg, htxt))
-
-        helptxt = HELP.format(
-                    self.display_name,
-                    '\n'.join(help_commands),
-                    self.display_name,
-                    '\n'.join(help_messages))
+        # rooms and users seeing the same commands share the rendered help
+        visible = tuple(self.command_allowed(cmd, user, room)
+                        for cmd, entry in HELP_CMD_ENTRIES)
+        key = (self.display_name, visible)
+        helptxt = HELP_CACHE.get(key)
+        if helptxt is None:
+            help_commands = [entry for (cmd, entry), allowed
+                             in zip(HELP_CMD_ENTRIES, visible) if allowed]
+            helptxt = HELP_CACHE[key] = HELP.format(
+                        self.display_name,
+                        '\n'.join(help_commands),
+                        self.display_name,
+                        '\n'.join(HELP_MSG_ENTRIES))
         return helptxt
 
-    def handle_message(self, event, message):
-        command_found = False
-        for command in COMMANDS:
-            match = re.search(command, message, flags=re.IGNORECASE)
-            if match and (match.start() == 0 or
-                          self.is_name_in_message(message)):
-                logging.info("Command found, handling message: %s" % message)
-                command_found = True
-                args = message[match.start():].split(' ')
-                self.handle_command(event, args[0], args[1:], MODULE_CONFIG)
-                break
+    def scan_message(self, message):
+        """Matches the bot's name and all triggers.
+
+        Returns whether the bot was mentioned and a dict of the matching
+        trigger patterns to their match."""
+        mentioned = self.mention_re.search(message) is not None
+        # most messages match no trigger, which one search tells. When one
+        # matches, the combined regex can not tell all that do, as matches
+        # may overlap, so every pattern is tried on its own then.
+        candidates = TRIGGER_SEPARATE
+        if TRIGGER_RE is not None and TRIGGER_RE.search(message):
+            candidates = TRIGGER_COMBINED + TRIGGER_SEPARATE
+        triggered = {}
+        for pattern, pattern_re in candidates:
+            match = pattern_re.search(message)
+            if match is not None:
+                triggered[pattern] = match
+        return mentioned, triggered
+
+    def handle_triggers(self, event, message, triggered):
+        room = self.get_room(event)
+        for pattern, match in triggered.items():
+            if self.command_allowed(trigger_acl_key(pattern),
+                                    event['sender'], room):
+                TRIGGER_REGISTRY[pattern](
+                    event, message, self, match, TRIGGERS_CONFIG[pattern])
+
+    def handle_message(self, event, message, mentioned=None):
+        if mentioned is None:
+            mentioned = self.is_name_in_message(message)
+        command, pos = find_command(message, mentioned)
+        command_found = command is not None
+        if command_found:
+            logging.info("Command found, handling message: %s" % message)
+            args = message[pos:].split(' ')
+            self.handle_command(event, command, args[1:], MODULE_CONFIG)
         if not command_found and message.startswith('!help'):
             self.reply(event, self.get_help(event), html=True)
 
         return command_found
 
-    def handle_event(self, event):
-        """Handles the given event.
-        """
-        self.send_read_receipt(event)
-
+    def text_message(self, event):
+        """Returns the text of the event, if it is a text message the bot
+        should look at, None otherwise."""
         # only care about text messages
         if event['type'] != 'm.room.message' or \
                 event['content']['msgtype'] != 'm.text':
-            return
+            return None
 
         # dont care about messages by myself
         if event['sender'] == self.client.user_id:
+            return None
+
+        return str(event['content']['body'])
+
+    def update_state(self, event):
+        """Updates what the bot derived from the state of a room."""
+        if event['type'] == 'm.room.canonical_alias':
+            self.acl_cache.pop(event.get('room_id'), None)
+        if event['type'] in ('m.room.name', 'm.room.canonical_alias',
+                             'm.room.member'):
+            room = self.client.rooms.get(event.get('room_id'))
+            if room is None:
+                # the bot left the room
+                self.directory.remove(event.get('room_id'))
+            else:
+                self.directory.update(room)
+
+    def handle_event(self, event):
+        """Handles the given event.
+        """
+        self.send_read_receipt(event)
+        self.update_state(event)
+
+        message = self.text_message(event)
+        if message is None:
             return
 
-        message = str(event['content']['body'])
-        command_found = self.handle_message(event, message)
-        if not command_found and self.display_name in message:
-            room = self.get_room(event)
-            if self.is_name_in_message(message):
-                self.reply(event, "Don't mess with me, buddy. "
-                                  "Try !help instead.")
+        mentioned, triggered = self.scan_message(message)
+        command_found = self.handle_message(event, message, mentioned)
+        if command_found:
+            return
+        self.handle_triggers(event, message, triggered)
+        if not triggered and mentioned and self.display_name in message:
+            self.reply(event, "Don't mess with me, buddy. "
+                              "Try !help instead.")
 
     def set_display_name(self, display_name):
         """Sets the bot's display name on the server."""
@@ -303,15 +1410,16 @@ class Bot(object):
 
         # listen for invites, including initial sync invites
         self.client.add_invite_listener(
-            lambda room_id, state: self.invite_queue.put((room_id, state)))
+            lambda room_id, state: self.inbox.put(('invite', (room_id, state))))
 
         # get rid of initial event sync
         logging.info("initial event stream")
         self.client.listen_for_events()
+        self.directory.rebuild(list(self.client.rooms.values()))
 
-        # listen to events and add them all to the event queue
+        # listen to events and add them all to the inbox
         # for handling in this thread
-        self.client.add_listener(self.event_queue.put)
+        self.client.add_listener(lambda event: self.inbox.put(('event', event)))
 
         def exception_handler(e):
             if isinstance(e, Timeout):
@@ -332,56 +1440,353 @@ class Bot(object):
             print("3. Network connectivity is working")
             sys.exit(1)
 
-        last_cron = time.time()
-        last_mqtt_check = time.time()
-        secs = 0
+        self.scheduler.start(time.monotonic())
 
         while True:
-            now = time.time()
-
-            # handle any queued events
-            while not self.event_queue.empty():
-                event = self.event_queue.get_nowait()
-                self.handle_event(event)
-
-            while not self.invite_queue.empty():
-                room_id, invite_state = self.invite_queue.get_nowait()
-                self.handle_invite(room_id, invite_state)
-
-            # handle cron-type modules every 1 second
-            if now - last_cron >= 1:
-                secs += int(now - last_cron)
-                last_cron = now
-                for cronsecs, func, module_name in CRON_REGISTRY:
-                    if secs % int(cronsecs) == 0:
-                        logging.info('Executing cron plugin %s.' % module_name)
-                        func(self, MODULE_CONFIG[module_name])
-
-            if secs > 65000:
-                secs = 0
-
-            # check connection to mqtt every 15 seconds
-            if now - last_mqtt_check >= 15:
-                last_mqtt_check = now
-                if hasattr(self, 'mqtt_client') and not self.mqtt_client.is_connected():
-                    logging.warning("MQTT disconnected, attempting to reconnect...")
-                    self.connect_mqtt()
-
-            # avoid busy loop
-            time.sleep(0.05)
+            self.step()
 
         logging.info("stopping listener thread")
         self.client.stop_listener_thread()
 
+    def next_deadline(self):
+        """Returns the monotonic time the next cron job is due.
+
+        Returns None if there is nothing to do besides handling events."""
+        return self.scheduler.next_deadline()
+
+    def run_cron_job(self, job, runs=1):
+        """Runs the job in its own thread, unless it is still running."""
+        now = time.monotonic()
+        job.check_timeout(now)
+        if not job.try_start(now):
+            job.skipped += runs
+            log.warning('Cron plugin %s is still running, skipping it.',
+                        job.module_name)
+            return
+        threading.Thread(target=self._run_cron_worker, args=(job, runs),
+                         name='cron-{}'.format(job.module_name),
+                         daemon=True).start()
+
+    def _run_cron_worker(self, job, runs):
+        try:
+            for run in range(runs):
+                logging.info('Executing cron plugin %s.' % job.module_name)
+                job.record_run(time.monotonic())
+                job.func(self, MODULE_CONFIG[job.module_name])
+        except Exception:
+            log.exception('Error in cron plugin %s', job.module_name)
+        finally:
+            job.finish(time.monotonic())
+
+    def dispatch(self, item):
+        """Handles an item taken from the inbox."""
+        kind, payload = item
+        if kind == 'event' and self.executor is not None:
+            # keep the order of events within a room
+            self.executor.submit(payload.get('room_id'), self.handle_event,
+                                 payload)
+        elif kind == 'event':
+            self.handle_event(payload)
+        elif kind == 'invite':
+            room_id, invite_state = payload
+            self.handle_invite(room_id, invite_state)
+
+    def step(self):
+        """Waits for the next inbox item or deadline and handles it."""
+        deadline = self.next_deadline()
+        timeout = None
+        if deadline is not None:
+            timeout = max(0, deadline - time.monotonic())
+        try:
+            item = self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            pass
+        else:
+            self.dispatch(item)
+
+        now = time.monotonic()
+        for job, runs in self.scheduler.pop_due(now):
+            self.run_cron_job(job, runs)
+
     def send_read_receipt(self, event):
-        """Sends a read receipt for the given event."""
-        if "room_id" in event and "event_id" in event:
-            content = dict() 
-            room_id = urllib.parse.quote(event['room_id'])
-            event_id = urllib.parse.quote(event['event_id'])
-            self.client.api._send("POST", "/rooms/" + room_id +
-                                  "/receipt/m.read/" + event_id,
-                                  api_path="/_matrix/client/r0", content=content)
+        """Sends a read receipt for the given event.
+
+        Depending on the read_receipts setting, the receipt is sent right
+        away, coalesced with later ones of the room, or not at all."""
+        if "room_id" not in event or "event_id" not in event:
+            return
+        if self.receipts is not None:
+            self.receipts.mark_read(event['room_id'], event['event_id'])
+        elif self.read_receipts == 'immediate':
+            self.post_read_receipt(event['room_id'], event['event_id'])
+
+    def post_read_receipt(self, room_id, event_id):
+        """Posts a read receipt for the given event to the server."""
+        content = dict() 
+        room_id = urllib.parse.quote(room_id)
+        event_id = urllib.parse.quote(event_id)
+        self.client.api._send("POST", "/rooms/" + room_id +
+                              "/receipt/m.read/" + event_id,
+                              api_path="/_matrix/client/r0", content=content)
+
+
+class AsyncBot(Bot):
+    """Runs the bot on an asyncio event loop.
+
+    The matrix sync, mqtt, cron jobs and outgoing messages are all driven
+    by one event loop. Handlers defined with `async def` are awaited on
+    that loop, plain handlers run in the loop's thread pool."""
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        # events are ordered by the per-room locks instead
+        self.executor = None
+        self.loop = None
+        self.room_locks = collections.defaultdict(asyncio.Lock)
+        self.async_limits = {}
+        self.tasks = set()
+
+    def run(self):
+        """Indefinitely listens for messages and handles all that come."""
+        asyncio.run(self.run_async())
+
+    def spawn(self, coro):
+        """Runs coro as a task, logging exceptions it raises."""
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error('Error in task', exc_info=task.exception())
+
+    async def call(self, func, *args):
+        """Calls func with args, in the thread pool if it is not async."""
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args)
+        return await self.loop.run_in_executor(
+            None, functools.partial(func, *args))
+
+    async def reply_async(self, event, message, html=False):
+        """Replies to the given event without blocking the event loop."""
+        self.reply(event, message, html)
+
+    async def send_html_async(self, room, msg):
+        """Sends msg to room without blocking the event loop."""
+        self.send_html(room, msg)
+
+    async def run_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers or None, thread_name_prefix='handler'))
+        self.inbox = asyncio.Queue()
+
+        current_display_name = await self.call(self.get_display_name)
+        if current_display_name != self.display_name:
+            await self.call(self.set_display_name, self.display_name)
+
+        def put(item):
+            self.loop.call_soon_threadsafe(self.inbox.put_nowait, item)
+
+        self.client.add_invite_listener(
+            lambda room_id, state: put(('invite', (room_id, state))))
+        # get rid of initial event sync
+        logging.info("initial event stream")
+        await self.call(self.client.listen_for_events)
+        self.directory.rebuild(list(self.client.rooms.values()))
+        self.client.add_listener(lambda event: put(('event', event)))
+
+        if not await self.connect_mqtt_async():
+            print(f"Error: Failed to connect to MQTT broker '{self.mqtt_broker}'")
+            sys.exit(1)
+
+        self.scheduler.start(time.monotonic())
+        if self.scheduler.jobs:
+            self.spawn(self.run_scheduler())
+        await asyncio.gather(self.sync_forever(), self.consume_inbox())
+
+    async def sync_forever(self):
+        """Long-polls the matrix server, the listeners fill the inbox."""
+        # the sync blocks a thread while polling, keep it off the pool
+        sync_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='sync')
+        backoff = 1
+        while True:
+            try:
+                await self.loop.run_in_executor(
+                    sync_executor, self.client.listen_for_events)
+                backoff = 1
+            except (MatrixRequestError, matrix_client.errors.MatrixHttpLibError,
+                    ConnectionError, Timeout) as e:
+                # matrix_client wraps connection errors and timeouts in
+                # MatrixHttpLibError
+                logging.warning(
+                    'sync failed ({}), retrying in {} s'.format(e, backoff))
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    async def consume_inbox(self):
+        while True:
+            kind, payload = await self.inbox.get()
+            if kind == 'event':
+                self.spawn(self.handle_event_async(payload))
+            elif kind == 'invite':
+                room_id, invite_state = payload
+                self.spawn(self.call(
+                    self.handle_invite, room_id, invite_state))
+
+    async def handle_event_async(self, event):
+        """Handles the given event, in order with the others of its room."""
+        async with self.room_locks[event.get('room_id')]:
+            if self.read_receipts == 'immediate':
+                # posts to the server
+                await self.call(self.send_read_receipt, event)
+            else:
+                self.send_read_receipt(event)
+            self.update_state(event)
+
+            message = self.text_message(event)
+            if message is None:
+                return
+
+            mentioned, triggered = self.scan_message(message)
+            cmd, pos = find_command(message, mentioned)
+            if cmd is not None:
+                logging.info("Command found, handling message: %s" % message)
+                args = message[pos:].split(' ')
+                await self.handle_command_async(event, cmd, args[1:])
+                return
+            if message.startswith('!help'):
+                await self.reply_async(event, self.get_help(event), html=True)
+            await self.handle_triggers_async(event, message, triggered)
+            if not triggered and mentioned and self.display_name in message:
+                await self.reply_async(event, "Don't mess with me, buddy. "
+                                              "Try !help instead.")
+
+    async def handle_triggers_async(self, event, message, triggered):
+        room = self.get_room(event)
+        for pattern, match in triggered.items():
+            if self.command_allowed(trigger_acl_key(pattern),
+                                    event['sender'], room):
+                await self.call(TRIGGER_REGISTRY[pattern], event, message,
+                                self, match, TRIGGERS_CONFIG[pattern])
+
+    async def handle_command_async(self, event, cmd, args):
+        command = COMMAND_REGISTRY.get(cmd)
+        if command is None:
+            return
+        if not self.command_allowed(cmd, event['sender'], self.get_room(event)):
+            return
+        module_name = COMMAND_MODULES.get(cmd)
+        config = MODULE_CONFIG.get(module_name)
+        if module_name not in MODULE_LIMITS:
+            await self.call(command, event, command, self, args, config)
+            return
+        if module_name not in self.async_limits:
+            self.async_limits[module_name] = asyncio.Semaphore(
+                MODULE_LIMITS[module_name].limit)
+        # waiting here holds no thread, plain commands only take one
+        # from the pool once they may run
+        async with self.async_limits[module_name]:
+            await self.call(command, event, command, self, args, config)
+
+    async def run_scheduler(self):
+        while True:
+            await asyncio.sleep(
+                max(0, self.scheduler.next_deadline() - time.monotonic()))
+            for job, runs in self.scheduler.pop_due(time.monotonic()):
+                self.run_cron_job(job, runs)
+
+    def run_cron_job(self, job, runs=1):
+        if not asyncio.iscoroutinefunction(job.func):
+            super().run_cron_job(job, runs)
+            return
+        now = time.monotonic()
+        job.check_timeout(now)
+        if not job.try_start(now):
+            job.skipped += runs
+            log.warning('Cron plugin %s is still running, skipping it.',
+                        job.module_name)
+            return
+        self.spawn(self.run_cron_job_async(job, runs))
+
+    async def run_cron_job_async(self, job, runs):
+        async def run_all():
+            for run in range(runs):
+                logging.info('Executing cron plugin %s.' % job.module_name)
+                job.record_run(time.monotonic())
+                await job.func(self, MODULE_CONFIG[job.module_name])
+
+        try:
+            # unlike threads, coroutines can be cancelled on timeout
+            await asyncio.wait_for(run_all(), job.timeout)
+        except asyncio.TimeoutError:
+            pass
+        except Exception:
+            log.exception('Error in cron plugin %s', job.module_name)
+        finally:
+            job.finish(time.monotonic())
+
+    def mqtt_received(self, client, data, message):
+        # called on the event loop, which must not block
+        for handler, config in self.message_handlers(message.topic):
+            self.spawn(self.call(handler, message, data, client, self, config))
+
+    async def connect_mqtt_async(self):
+        """Connects to the mqtt broker, driving the client from the loop."""
+        if not self.mqtt_broker:
+            return True
+        logging.info("connecting to mqtt server")
+        mqtt_client = make_mqtt_client(self.mqtt_client_id)
+        mqtt_client.enable_logger(logger=log)
+
+        def on_connect(client, userdata, flags, rc):
+            if rc != 0:
+                logging.error(f'MQTT connect failed with code {rc}')
+                return
+            logging.info('mqtt connected.')
+            subscribe_to_topics(client, userdata, flags, rc)
+
+        mqtt_client.on_connect = on_connect
+        mqtt_client.on_message = self.mqtt_received
+        # (re)connecting runs in the thread pool, which must not touch
+        # the loop directly
+        on_loop = self.loop.call_soon_threadsafe
+        mqtt_client.on_socket_open = lambda client, userdata, sock: \
+            on_loop(self.loop.add_reader, sock, client.loop_read)
+        mqtt_client.on_socket_close = lambda client, userdata, sock: \
+            on_loop(self.loop.remove_reader, sock)
+        mqtt_client.on_socket_register_write = \
+            lambda client, userdata, sock: \
+            on_loop(self.loop.add_writer, sock, client.loop_write)
+        mqtt_client.on_socket_unregister_write = \
+            lambda client, userdata, sock: on_loop(self.loop.remove_writer, sock)
+        self.mqtt_client = mqtt_client
+        try:
+            await self.call(mqtt_client.connect, self.mqtt_broker)
+        except Exception as e:
+            logging.error(f'MQTT connect failed: {e}')
+            return False
+        self.spawn(self.mqtt_housekeeping())
+        return True
+
+    async def mqtt_housekeeping(self):
+        """Sends keepalives and reconnects, the job of paho's loop thread."""
+        backoff = MQTT_RECONNECT_MIN
+        while True:
+            await asyncio.sleep(1)
+            if self.mqtt_client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                backoff = MQTT_RECONNECT_MIN
+                continue
+            logging.warning("MQTT disconnected, attempting to reconnect...")
+            try:
+                await self.call(self.mqtt_client.reconnect)
+                backoff = MQTT_RECONNECT_MIN
+            except OSError as e:
+                logging.error(f'MQTT reconnect failed: {e}')
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MQTT_RECONNECT_MAX)
 
 
 def main():
@@ -390,8 +1795,12 @@ def main():
     argparser.add_argument("--debug",
                            help="Print out way more things.",
                            action="store_true")
+    argparser.add_argument("--profile-startup",
+                           help="Print how long loading each module took.",
+                           action="store_true")
     args = vars(argparser.parse_args())
     debug = args['debug']
+    started = time.perf_counter()
 
     # suppress logs of libraries
     logging.getLogger("requests").setLevel(logging.WARNING)
@@ -412,6 +1821,30 @@ def main():
     password = config['bot']['password']
     display_name = config['bot']['display_name']
     mqtt_broker = config['bot']['mqtt_broker']
+    workers = config['bot'].getint('workers', 0)
+    read_receipts = config['bot'].get('read_receipts', 'coalesced')
+    if read_receipts not in READ_RECEIPT_MODES:
+        print(f'Error: read_receipts in [bot] must be one of {", ".join(READ_RECEIPT_MODES)}.')
+        sys.exit(1)
+    receipt_interval = config['bot'].getfloat('read_receipt_interval', 1)
+    send_workers = config['bot'].getint('send_workers', 2)
+    mqtt_queue_size = config['bot'].getint('mqtt_queue_size', 1000)
+    mqtt_queue_policy = config['bot'].get('mqtt_queue_policy', 'block')
+    mqtt_client_id = config['bot'].get('mqtt_client_id', 'horscht')
+    if mqtt_queue_policy not in MQTT_QUEUE_POLICIES:
+        print(f'Error: mqtt_queue_policy in [bot] must be one of {", ".join(MQTT_QUEUE_POLICIES)}.')
+        sys.exit(1)
+    http = HttpClient.from_config(config['bot'])
+    bot_class = Bot
+    if config['bot'].get('runtime', 'threads') == 'asyncio':
+        bot_class = AsyncBot
+    # manifest of the last start -> manifest of the configured modules
+    old_manifest = manifest = None
+    if config['bot'].getboolean('lazy_modules', False):
+        old_manifest = load_manifest()
+        manifest = {}
+    # (section, module, import seconds, init seconds, lazy)
+    timings = []
 
     for module_name in config.sections():
         if module_name == 'bot':
@@ -426,21 +1859,51 @@ def main():
             sys.exit(1)
             
         module = config[module_name]["module"]
+        module_started = time.perf_counter()
         try:
-            mod = importlib.import_module(module)
+            if manifest is not None and module in old_manifest:
+                manifest[module] = old_manifest[module]
+            mod = load_module(module, manifest)
         except ImportError:
             logging.error(
                 'Module {} not found. Ignoring.'.format(module))
             continue
+        imported = time.perf_counter()
         MODULE_CONFIG[module_name] = config[module_name]
+        if 'concurrency' in config[module_name]:
+            try:
+                concurrency = config[module_name].getint('concurrency')
+            except ValueError:
+                concurrency = 0
+            if concurrency <= 0:
+                print(f'Error: "concurrency=" in section [{module_name}] must be a positive number.')
+                sys.exit(1)
+            MODULE_LIMITS[module_name] = ModuleLimit(concurrency)
 
         logging.info('Loaded extension {} with name {}'.format(module, module_name))
         if hasattr(mod, 'CMDS'):
             for cmd, func in mod.CMDS.items():
                 HELP_CMDS.append((cmd, func.__doc__))
-                ACL_USERS[cmd] = config[module_name].get('allowed_users')
-                ACL_ROOMS[cmd] = config[module_name].get('allowed_rooms')
+                ACL_USERS[cmd] = parse_acl(
+                    config[module_name].get('allowed_users'))
+                ACL_ROOMS[cmd] = parse_acl(
+                    config[module_name].get('allowed_rooms'))
+                COMMAND_MODULES[cmd] = module_name
             COMMAND_REGISTRY.update(mod.CMDS)
+        if hasattr(mod, 'TRIGGERS'):
+            for pattern, func in mod.TRIGGERS.items():
+                try:
+                    TRIGGER_PATTERNS[pattern] = re.compile(
+                        pattern, flags=re.IGNORECASE)
+                except re.error as e:
+                    print(f'Error: Invalid trigger {pattern!r} in module {module}: {e}')
+                    sys.exit(1)
+                TRIGGERS_CONFIG[pattern] = config[module_name]
+                ACL_USERS[trigger_acl_key(pattern)] = parse_acl(
+                    config[module_name].get('allowed_users'))
+                ACL_ROOMS[trigger_acl_key(pattern)] = parse_acl(
+                    config[module_name].get('allowed_rooms'))
+            TRIGGER_REGISTRY.update(mod.TRIGGERS)
         if hasattr(mod, 'MSGS'):
             for msg, func in mod.MSGS.items():
                 HELP_MSGS.append((msg, func.__doc__))
@@ -452,15 +1915,60 @@ def main():
                 print('Modules with scheduled tasks must specify the interval in seconds.')
                 print('Example: secs = 60')
                 sys.exit(1)
-            CRON_REGISTRY.append((config[module_name]["secs"], mod.CRON, module_name))
-
-    COMMANDS.extend(list(COMMAND_REGISTRY.keys()))
+            try:
+                secs = float(config[module_name]['secs'])
+                jitter = float(config[module_name].get('jitter', 0))
+                timeout = float(config[module_name].get('timeout', secs))
+            except ValueError:
+                secs = jitter = timeout = -1
+            if secs <= 0 or jitter < 0 or timeout <= 0:
+                print(f'Error: Section [{module_name}] needs positive numbers as "secs=", "jitter=" and "timeout=".')
+                sys.exit(1)
+            if jitter >= secs:
+                print(f'Error: "jitter=" in section [{module_name}] must be less than "secs=".')
+                sys.exit(1)
+            missed = config[module_name].get('missed', 'skip')
+            if missed not in CRON_MISSED_POLICIES:
+                print(f'Error: "missed=" in section [{module_name}] must be one of {", ".join(CRON_MISSED_POLICIES)}.')
+                sys.exit(1)
+            CRON_REGISTRY.append(
+                CronJob(module_name, mod.CRON, secs, missed, jitter, timeout))
+        timings.append((module_name, module, imported - module_started,
+                        time.perf_counter() - imported,
+                        isinstance(mod, LazyModule)))
+
+    if manifest is not None and manifest != old_manifest:
+        save_manifest(manifest)
+    indexing = time.perf_counter()
+    build_command_index()
+    build_message_routes()
+    build_help()
+    try:
+        build_trigger_re()
+    except re.error as e:
+        print(f'Error: The triggers can not be combined into one expression: {e}')
+        print('Scope inline flags to their group, e.g. (?s:x.y) instead of (?s)x.y')
+        sys.exit(1)
+    if args['profile_startup']:
+        print('{:24s} {:32s} {:>10s} {:>10s}'.format(
+            'section', 'module', 'import ms', 'init ms'))
+        for module_name, module, import_secs, init_secs, lazy in timings:
+            print('{:24s} {:32s} {:10.2f} {:10.2f}{}'.format(
+                module_name, module, import_secs * 1000, init_secs * 1000,
+                ' (lazy)' if lazy else ''))
+        print('{:24s} {:32s} {:>10s} {:10.2f}'.format(
+            '', 'indexes', '', (time.perf_counter() - indexing) * 1000))
+        print('{:24s} {:32s} {:>10s} {:10.2f}'.format(
+            '', 'total', '', (time.perf_counter() - started) * 1000))
 
 
 
 
     while True:
-        bot = Bot(server, username, password, display_name, mqtt_broker)
+        bot = bot_class(server, username, password, display_name,
+                        mqtt_broker, workers, read_receipts, receipt_interval,
+                        send_workers, mqtt_queue_size, mqtt_queue_policy,
+                        mqtt_client_id, http)
         bot.login()
         bot.run()
 
@@ -6,8 +6,7 @@ def announce_nachkauf(message, data, client, bot, config):
     logging.error("reacting to space/nachkaufen")
 
     payload = message.payload.decode('utf8')
-    for room in list(bot.client.rooms.values()):
-        if room.display_name.lower() in ('einkauf',):
-            bot.send_html(room, payload)
+    for room in bot.directory.named('einkauf', ignore_case=True):
+        bot.send_html(room, payload)
 
 MSGS = { 'space/nachkaufen': announce_nachkauf } 
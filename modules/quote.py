@@ -6,21 +6,15 @@ def quote(event, message, bot, args, config):
 
     # search given room
     roomname = args[0]    
-    found = False
-    for room_id in bot.client.rooms:
-        room = bot.client.rooms[room_id]
-        if room.display_name == roomname:
-            found = True
-            break
-    
-    if not found:
+    room = bot.directory.get(roomname)
+    if room is None:
         bot.reply(event, 'Raum {} nicht gefunden.'.format(roomname))
         return
 
     # cook quote and send to room
     txt = " ".join(args[1:]).replace('\n', '<br/>')
     repl = '<blockquote>{}</blockquote>'.format(txt)
-    room.send_html(repl)
+    bot.send_html(room, repl)
 
 
 CMDS = {'!quote': quote}
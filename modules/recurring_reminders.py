@@ -7,15 +7,31 @@ Example: !reminder monday 14:30 Team meeting in conference room
 
 Supports weekdays in German: montag, dienstag, mittwoch, donnerstag, freitag, samstag, sonntag
 Time format: HH:MM (24-hour format)
+
+Config options:
+timezone: Timezone of the reminder times, e.g. Europe/Berlin (default: local time)
+grace: Reminders missed by at most this many seconds, e.g. because the
+       bot was restarting, are still sent (default: 600)
 """
 
 import datetime
+import heapq
+import itertools
 import json
 import os
 import html
+import threading
+import time
+import zoneinfo
 
 # File to store reminders persistently
 REMINDERS_FILE = "reminders.json"
+# File to store when each reminder was sent last
+SENT_FILE = "sent_reminders.json"
+# What older versions used instead, read once if SENT_FILE is missing
+LEGACY_SENT_FILE = "sent_reminders_today.json"
+# Reminders missed by at most this many seconds are still sent
+DEFAULT_GRACE = 600
 
 # German weekday mapping
 WEEKDAY_MAP = {
@@ -53,6 +69,179 @@ def save_reminders(reminders):
     except IOError:
         print(f"Error: Could not save reminders to {REMINDERS_FILE}")
 
+def load_sent():
+    """Load the timestamps reminders were last sent at."""
+    if os.path.exists(SENT_FILE):
+        try:
+            with open(SENT_FILE, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return {}
+    return {}
+
+def load_legacy_sent(reminders):
+    """Convert the sent reminders of LEGACY_SENT_FILE to the SENT_FILE format.
+
+    That file has keys like "<id>_<HH:MM>" and the local time the reminder
+    was sent at as value."""
+    if not os.path.exists(LEGACY_SENT_FILE):
+        return {}
+    try:
+        with open(LEGACY_SENT_FILE, 'r') as f:
+            legacy = json.load(f).get('sent', {})
+    except (json.JSONDecodeError, IOError, AttributeError):
+        return {}
+    sent = {}
+    for key, sent_at in legacy.items():
+        reminder_id = key.rsplit('_', 1)[0]
+        try:
+            sent_at = datetime.datetime.fromisoformat(sent_at).timestamp()
+        except (TypeError, ValueError):
+            continue
+        for reminder in reminders:
+            if str(reminder['id']) == reminder_id:
+                key = reminder_key(reminder)
+                sent[key] = max(sent.get(key, 0), sent_at)
+    return sent
+
+def save_sent(sent):
+    """Save the timestamps reminders were last sent at."""
+    try:
+        with open(SENT_FILE, 'w') as f:
+            json.dump(sent, f, indent=2)
+    except IOError:
+        print(f"Warning: Could not save sent reminders to {SENT_FILE}")
+
+def file_signature(path):
+    """Returns something that changes whenever the file changes."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def reminder_key(reminder):
+    return f"{reminder['room_id']}/{reminder['id']}"
+
+def next_fire(reminder, after, tz):
+    """Timestamp of the first occurrence of reminder after the timestamp after.
+
+    Occurrences are wall clock times in tz (local time if None), so they
+    stay at the same time of day across DST changes."""
+    day = datetime.datetime.fromtimestamp(after, tz).date()
+    at = datetime.time(reminder['hour'], reminder['minute'])
+    for days in range(8):
+        date = day + datetime.timedelta(days=days)
+        if date.weekday() != reminder['weekday']:
+            continue
+        fire = datetime.datetime.combine(date, at, tzinfo=tz).timestamp()
+        if fire > after:
+            return fire
+    return next_fire(reminder, after + 7 * 86400, tz)
+
+
+class ReminderIndex(object):
+    """Keeps the reminders in memory, in a heap ordered by next fire time.
+
+    reminders.json is only read again when it changed on disk."""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reminders = []
+        self.heap = []
+        self.seq = itertools.count()
+        self.signature = None
+        self.sent = None
+        self.tz = None
+        self.grace = DEFAULT_GRACE
+
+    def configure(self, config):
+        """Takes timezone and grace from the module's config section."""
+        tz = config.get('timezone')
+        tz = zoneinfo.ZoneInfo(tz) if tz else None
+        grace = int(config.get('grace', DEFAULT_GRACE))
+        with self.lock:
+            if (tz, grace) != (self.tz, self.grace):
+                self.tz, self.grace = tz, grace
+                self.rebuild()
+
+    def refresh(self):
+        """Reloads the reminders if the file changed."""
+        with self.lock:
+            signature = file_signature(REMINDERS_FILE)
+            changed = signature != self.signature
+            if changed:
+                self.signature = signature
+                self.reminders = load_reminders()
+            if self.sent is None:
+                if os.path.exists(SENT_FILE):
+                    self.sent = load_sent()
+                else:
+                    # first start after an upgrade, do not send again what
+                    # the old version sent within the grace window
+                    self.sent = load_legacy_sent(self.reminders)
+                    if self.sent:
+                        save_sent(self.sent)
+            if changed:
+                self.rebuild()
+
+    def rebuild(self):
+        self.heap = []
+        for reminder in self.reminders:
+            self.schedule(reminder, time.time())
+
+    def schedule(self, reminder, now):
+        # reminders not sent yet are still due within the grace window
+        after = max(now - self.grace,
+                    (self.sent or {}).get(reminder_key(reminder), 0))
+        heapq.heappush(self.heap, (next_fire(reminder, after, self.tz),
+                                   next(self.seq), reminder))
+
+    def get(self):
+        self.refresh()
+        return self.reminders
+
+    def add(self, reminder):
+        with self.lock:
+            self.refresh()
+            self.reminders.append(reminder)
+            save_reminders(self.reminders)
+            self.signature = file_signature(REMINDERS_FILE)
+            self.schedule(reminder, time.time())
+
+    def remove(self, room_id, reminder_id):
+        with self.lock:
+            self.refresh()
+            self.reminders = [r for r in self.reminders
+                              if not (r['id'] == reminder_id and
+                                      r['room_id'] == room_id)]
+            save_reminders(self.reminders)
+            self.signature = file_signature(REMINDERS_FILE)
+            self.rebuild()
+
+    def pop_due(self, now):
+        """Returns (fire time, reminder) of all reminders due at now.
+
+        They are rescheduled for their next occurrence right away."""
+        due = []
+        with self.lock:
+            self.refresh()
+            while self.heap and self.heap[0][0] <= now:
+                fire, seq, reminder = heapq.heappop(self.heap)
+                due.append((fire, reminder))
+                heapq.heappush(self.heap, (
+                    next_fire(reminder, max(fire, now - self.grace), self.tz),
+                    next(self.seq), reminder))
+        return due
+
+    def mark_sent(self, reminders, now):
+        with self.lock:
+            for reminder in reminders:
+                self.sent[reminder_key(reminder)] = now
+            save_sent(self.sent)
+
+
+INDEX = ReminderIndex()
+
 def create_reminder(event, message, bot, args, config):
     """Create a new recurring reminder."""
     
@@ -126,7 +315,7 @@ def create_reminder(event, message, bot, args, config):
 
     # Create reminder object
     reminder = {
-        'id': len(load_reminders()) + 1,
+        'id': max((r['id'] for r in INDEX.get()), default=0) + 1,
         'weekday': WEEKDAY_MAP[weekday_str],
         'weekday_name': weekday_str.capitalize(),
         'hour': hour,
@@ -138,10 +327,7 @@ def create_reminder(event, message, bot, args, config):
         'created_at': datetime.datetime.now().isoformat()
     }
     
-    # Load existing reminders and add the new one
-    reminders = load_reminders()
-    reminders.append(reminder)
-    save_reminders(reminders)
+    INDEX.add(reminder)
     
     # Confirm creation
     confirmation = f"""
@@ -160,7 +346,7 @@ def list_reminders(event, message, bot, args, config):
     """List all reminders for the current room."""
     
     room_id = event['room_id']
-    reminders = load_reminders()
+    reminders = INDEX.get()
     
     # Filter reminders for this room
     room_reminders = [r for r in reminders if r['room_id'] == room_id]
@@ -193,7 +379,7 @@ def delete_reminder(event, message, bot, args, config):
         return
     
     room_id = event['room_id']
-    reminders = load_reminders()
+    reminders = INDEX.get()
     
     # Find the reminder to delete
     reminder_to_delete = None
@@ -206,8 +392,7 @@ def delete_reminder(event, message, bot, args, config):
         bot.reply(event, f"❌ Reminder #{reminder_id} nicht gefunden oder nicht in diesem Raum vorhanden.", html=True)
         return
     
-    reminders = [r for r in reminders if not (r['id'] == reminder_id and r['room_id'] == room_id)]
-    save_reminders(reminders)
+    INDEX.remove(room_id, reminder_id)
     
     confirmation = f"""
 ✅ <b>Reminder gelöscht!</b><br><br>
@@ -222,74 +407,32 @@ def delete_reminder(event, message, bot, args, config):
 def check_reminders(bot, config):
     """Check if any reminders should be sent now."""
     
-    now = datetime.datetime.now()
-    current_minute = now.replace(second=0, microsecond=0)
-    
-    # Load reminders
-    reminders = load_reminders()
-    
-    # File to track sent reminders to prevent duplicates
-    sent_file = "sent_reminders_today.json"
-    today_str = now.strftime('%Y-%m-%d')
-    
-    # Load today's sent reminders
-    sent_today = {}
-    if os.path.exists(sent_file):
-        try:
-            with open(sent_file, 'r') as f:
-                data = json.load(f)
-                # Only keep today's data, clean up old entries
-                if data.get('date') == today_str:
-                    sent_today = data.get('sent', {})
-        except (json.JSONDecodeError, IOError):
-            pass
-    
-    current_weekday = current_minute.weekday()
-    current_hour = current_minute.hour
-    current_minute_val = current_minute.minute
-    
+    INDEX.configure(config)
+    now = time.time()
     newly_sent = []
     
-    for reminder in reminders:
-        # Check if this reminder should fire right now
-        if (reminder['weekday'] == current_weekday and 
-            reminder['hour'] == current_hour and 
-            reminder['minute'] == current_minute_val):
-            
-            # Create unique key for this reminder today
-            reminder_key = f"{reminder['id']}_{current_minute.strftime('%H:%M')}"
-            
-            # Skip if already sent today at this time
-            if reminder_key in sent_today:
-                continue
+    for fire, reminder in INDEX.pop_due(now):
+        if now - fire > INDEX.grace:
+            print(f"Skipping reminder {reminder['id']}, it was due at {datetime.datetime.fromtimestamp(fire)}")
+            continue
+        
+        # Send the reminder to the appropriate room
+        room_id = reminder['room_id']
+        if room_id in bot.client.rooms:
+            room = bot.client.rooms[room_id]
             
-            # Send the reminder to the appropriate room
-            room_id = reminder['room_id']
-            if room_id in bot.client.rooms:
-                room = bot.client.rooms[room_id]
-                
-                reminder_message = f"""🔔 <b>Reminder</b><br><br>
+            reminder_message = f"""🔔 <b>Reminder</b><br><br>
 
 {reminder['message']}"""
-                
-                try:
-                    room.send_html(reminder_message)
-                    sent_today[reminder_key] = current_minute.isoformat()
-                    newly_sent.append(reminder['id'])
-                    print(f"Sent reminder {reminder['id']} at {current_minute}")
-                except Exception as e:
-                    print(f"Error sending reminder to room {room_id}: {e}")
+            
+            # the outbox sends it, retrying on errors
+            bot.send_html(room, reminder_message)
+            newly_sent.append(reminder)
+            print(f"Queued reminder {reminder['id']} due at {datetime.datetime.fromtimestamp(fire)}")
     
-    # Save updated sent reminders if any were sent
+    # Remember queued reminders, so they are not sent again after a restart
     if newly_sent:
-        try:
-            with open(sent_file, 'w') as f:
-                json.dump({
-                    'date': today_str,
-                    'sent': sent_today
-                }, f, indent=2)
-        except IOError:
-            print(f"Warning: Could not save sent reminders to {sent_file}")
+        INDEX.mark_sent(newly_sent, now)
 
 # Register the commands and scheduled task
 CMDS = {
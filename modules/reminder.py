@@ -28,13 +28,15 @@ def announce_reminder(message, data, client, bot, config):
     # event_start formatieren dd.mm.yyyy hh:mm
     #msg = '<b>Erinnerung: %s</b> (%s)<br/>%s<br/><i>(noch %s)</i>' % (summary, desc, event_start, time_left)
     msg = '<b>Erinnerung: %s</b> (%s)<br/><i>(noch %s)</i>' % (summary, desc, time_left)
-    for room in list(bot.client.rooms.values()):
-        # XXX move to module configuration, allow multiple room names
-        if room.display_name in ('spacemaster',) and 'Tonne' not in msg:
-            bot.send_html(room, msg)
-        if room.display_name in ('Muell',) and 'Tonne' in msg:
-            bot.send_html(room, msg)
-        if room.display_name in ('sozialraum',) and 'Orgatreffen' in msg:
-            bot.send_html(room, msg)
+    # XXX move to module configuration, allow multiple room names
+    rooms = []
+    if 'Tonne' not in msg:
+        rooms += bot.directory.named('spacemaster')
+    if 'Tonne' in msg:
+        rooms += bot.directory.named('Muell')
+    if 'Orgatreffen' in msg:
+        rooms += bot.directory.named('sozialraum')
+    for room in rooms:
+        bot.send_html(room, msg)
 
 MSGS = { 'space/reminder': announce_reminder } 
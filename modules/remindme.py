@@ -0,0 +1,268 @@
+"""
+One-shot reminders for horscht bot
+
+Usage: !remindme in <dauer> <nachricht>
+       !remindme <datum> <uhrzeit> <nachricht>
+Examples: !remindme in 10m Pizza aus dem Ofen holen
+          !remindme 2026-12-24 18:00 Geschenke verteilen
+          !remindme 24.12.2026 18:00 Geschenke verteilen
+
+Durations are made of numbers with the units s, m, h, d, w (e.g. 1h30m).
+
+Config options:
+secs: How often to check for due reminders, e.g. 10
+timezone: Timezone of the given dates, e.g. Europe/Berlin (default: local time)
+
+Pending reminders are kept in a timing wheel and in an append-only
+journal file, which is only read when the bot starts.
+"""
+
+import datetime
+import functools
+import html
+import json
+import os
+import re
+import threading
+import time
+import zoneinfo
+
+# Append-only journal of added and finished reminders
+JOURNAL_FILE = "remindme.jsonl"
+
+DURATION_RE = re.compile(r'(\d+)([smhdw])')
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+DATE_FORMATS = ('%Y-%m-%d %H:%M', '%d.%m.%Y %H:%M')
+
+
+class TimingWheel(object):
+    """Hashed timing wheel with one slot per resolution seconds.
+
+    Adding and cancelling a timer is O(1), advancing costs one slot
+    lookup per elapsed slot (or per occupied slot, if there are fewer)."""
+    def __init__(self, resolution=1):
+        self.resolution = resolution
+        # slot number -> timer id -> (due, payload)
+        self.slots = {}
+        # timer id -> slot number
+        self.timers = {}
+        self.current = None
+
+    def __len__(self):
+        return len(self.timers)
+
+    def slot(self, due):
+        return int(due // self.resolution)
+
+    def add(self, timer_id, due, payload):
+        slot = self.slot(due)
+        if self.current is not None and slot <= self.current:
+            # already overdue, fires on the next advance
+            slot = self.current + 1
+        self.slots.setdefault(slot, {})[timer_id] = (due, payload)
+        self.timers[timer_id] = slot
+
+    def cancel(self, timer_id):
+        """Removes the timer, returns its (due, payload) or None."""
+        slot = self.timers.pop(timer_id, None)
+        if slot is None:
+            return None
+        timers = self.slots[slot]
+        timer = timers.pop(timer_id)
+        if not timers:
+            del self.slots[slot]
+        return timer
+
+    def advance(self, now):
+        """Removes and returns (timer id, due, payload) of expired timers."""
+        until = self.slot(now)
+        if self.current is None:
+            self.current = min(self.slots, default=until)
+            self.current = min(self.current, until) - 1
+        if until - self.current > len(self.slots):
+            slots = sorted(slot for slot in self.slots if slot <= until)
+        else:
+            slots = range(self.current + 1, until + 1)
+        expired = []
+        for slot in slots:
+            for timer_id, (due, payload) in self.slots.pop(slot, {}).items():
+                del self.timers[timer_id]
+                expired.append((timer_id, due, payload))
+        self.current = max(self.current, until)
+        return expired
+
+    def pending(self):
+        """Returns (timer id, due, payload) of all timers, by due time."""
+        return sorted(((timer_id, due, payload)
+                       for timers in self.slots.values()
+                       for timer_id, (due, payload) in timers.items()),
+                      key=lambda timer: timer[1])
+
+
+class ReminderStore(object):
+    """Pending reminders, persisted in a journal of add/done records."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wheel = None
+        self.next_id = 1
+
+    def load(self):
+        """Replays the journal, once. Compacts it if it got long."""
+        if self.wheel is not None:
+            return
+        self.wheel = TimingWheel()
+        records = 0
+        if os.path.exists(JOURNAL_FILE):
+            with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # e.g. a line cut off by a crash
+                        continue
+                    records += 1
+                    if record['op'] == 'add':
+                        self.wheel.add(record['id'], record['due'], record)
+                        self.next_id = max(self.next_id, record['id'] + 1)
+                    elif record['op'] == 'done':
+                        self.wheel.cancel(record['id'])
+        if records > 2 * len(self.wheel) + 100:
+            self.compact()
+
+    def compact(self):
+        tmp = JOURNAL_FILE + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for timer_id, due, record in self.wheel.pending():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp, JOURNAL_FILE)
+
+    def append(self, *records):
+        try:
+            with open(JOURNAL_FILE, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except IOError:
+            print(f"Error: Could not save reminders to {JOURNAL_FILE}")
+
+    def add(self, room_id, sender, due, text):
+        with self.lock:
+            self.load()
+            record = {'op': 'add', 'id': self.next_id, 'room_id': room_id,
+                      'sender': sender, 'due': due, 'message': text}
+            self.next_id += 1
+            self.wheel.add(record['id'], due, record)
+            self.append(record)
+            return record
+
+    def cancel(self, room_id, timer_id):
+        with self.lock:
+            self.load()
+            timer = self.wheel.cancel(timer_id)
+            if timer is not None and timer[1]['room_id'] != room_id:
+                # not this room's reminder, put it back
+                self.wheel.add(timer_id, *timer)
+                return None
+            if timer is not None:
+                self.append({'op': 'done', 'id': timer_id})
+            return timer
+
+    def pending(self, room_id):
+        with self.lock:
+            self.load()
+            return [record for timer_id, due, record in self.wheel.pending()
+                    if record['room_id'] == room_id]
+
+    def pop_due(self, now):
+        with self.lock:
+            self.load()
+            expired = self.wheel.advance(now)
+            if expired:
+                self.append(*({'op': 'done', 'id': timer_id}
+                              for timer_id, due, record in expired))
+            return [record for timer_id, due, record in expired]
+
+
+STORE = ReminderStore()
+
+
+def parse_due(args, now, tz):
+    """Returns (due timestamp, remaining args), or (None, args)."""
+    if len(args) >= 2 and args[0].lower() == 'in':
+        duration = args[1].lower()
+        parts = DURATION_RE.findall(duration)
+        if parts and ''.join(n + u for n, u in parts) == duration:
+            return now + sum(int(n) * DURATION_UNITS[u] for n, u in parts), \
+                args[2:]
+        return None, args
+    if len(args) >= 2:
+        for fmt in DATE_FORMATS:
+            try:
+                date = datetime.datetime.strptime(' '.join(args[:2]), fmt)
+            except ValueError:
+                continue
+            return date.replace(tzinfo=tz).timestamp(), args[2:]
+    return None, args
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(name):
+    """Returns the timezone called name, or None for local time."""
+    return zoneinfo.ZoneInfo(name) if name else None
+
+
+def format_due(due, tz):
+    return datetime.datetime.fromtimestamp(due, tz).strftime('%d.%m.%Y %H:%M')
+
+
+def remindme(event, message, bot, args, config):
+    """ <i>in 10m</i>|<i>2026-12-24 18:00</i> <i>nachricht</i> – Erinnert einmalig an etwas (<i>!remindme list</i>, <i>!remindme cancel nummer</i>)"""
+    room_id = event['room_id']
+    tz = get_timezone(config.get('timezone') if config else None)
+    if args and args[0].lower() == 'list':
+        pending = STORE.pending(room_id)
+        if not pending:
+            bot.reply(event, "Keine Erinnerungen für diesen Raum.")
+            return
+        lines = [f"<b>#{r['id']}</b> {format_due(r['due'], tz)} – {r['message']}"
+                 for r in pending]
+        bot.reply(event, '<br>'.join(lines), html=True)
+        return
+    if args and args[0].lower() == 'cancel':
+        try:
+            timer_id = int(args[1])
+        except (IndexError, ValueError):
+            bot.reply(event, "Bitte die Nummer der Erinnerung angeben.")
+            return
+        if STORE.cancel(room_id, timer_id) is None:
+            bot.reply(event, f"Erinnerung #{timer_id} nicht gefunden.")
+            return
+        bot.reply(event, f"Erinnerung #{timer_id} gelöscht.")
+        return
+
+    now = time.time()
+    due, rest = parse_due(args, now, tz)
+    if due is None or not rest:
+        bot.reply(event, "Verwendung: !remindme in 10m nachricht oder "
+                         "!remindme 2026-12-24 18:00 nachricht")
+        return
+    if due <= now:
+        bot.reply(event, "Dieser Zeitpunkt liegt in der Vergangenheit.")
+        return
+    record = STORE.add(room_id, event['sender'], due,
+                       html.escape(' '.join(rest)))
+    bot.reply(event, f"Erinnerung #{record['id']} für {format_due(due, tz)} gespeichert.")
+
+
+def check_timers(bot, config):
+    """Sends the reminders which are due."""
+    for record in STORE.pop_due(time.time()):
+        room = bot.client.rooms.get(record['room_id'])
+        if room is None:
+            continue
+        sender = html.escape(record['sender'])
+        bot.send_html(room, f"🔔 <b>Erinnerung</b> für {sender}:<br>{record['message']}")
+
+
+CMDS = {'!remindme': remindme}
+
+CRON = check_timers
@@ -1,22 +1,34 @@
+import collections
 import datetime
 import requests
 import logging
 import os
-import shutil
-import tempfile
-import json
-
-
-shlog = logging.getLogger('shlog')
-shlog.setLevel(logging.DEBUG)
-shlog_fh = logging.FileHandler('spacehistory.log')
-shlog_formatter = logging.Formatter('%(asctime)s - %(message)s')
-shlog_fh.setFormatter(shlog_formatter)
-shlog.addHandler(shlog_fh)
+import re
+import sqlite3
+import threading
+import time
+
+
+# status and doorbell history, see HistoryStore
+HISTORY_DB = 'spacehistory.sqlite'
+# the log the history used to be written to, imported once
+HISTORY_LOG = 'spacehistory.log'
+HISTORY_LOG_RE = re.compile(
+    r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),\d+ - (?:([\w/-]+): )?(.*)$')
+STATUS_TOPIC = 'space/status/open'
+DOORBELL_TOPIC = 'space/status/klingel'
+# !history shows this many weeks by default, and at most MAX_WEEKS
+HISTORY_WEEKS = 8
+MAX_WEEKS = 520
 
 SPACESTATUS_URL = 'https://eigenbaukombinat.de/status/status.json'
 SPACEOPEN_URL = 'https://eigenbaukombinat.de/status/openuntil.json'
 CURRENT_STATUS = 'zu'
+# seconds the status is trusted without news before asking the website,
+# can be set with status_ttl in the module config
+STATUS_TTL = 3600
+# seconds to wait before writing a changed status to .lastst
+PERSIST_DELAY = 5
 
 
 
@@ -29,19 +41,238 @@ def set_last_status(status):
         lastst.write(status)
 
 
+class SpaceStatus(object):
+    """The space status as last announced via MQTT, and a snapshot of it
+    for !status, which the website may refresh.
+
+    Announced changes are written to .lastst in the background."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # held while asking the website, so only one request is made
+        self.fetch_lock = threading.Lock()
+        # last status announced via MQTT, decides whether a message is news
+        self.announced = None
+        # what !status answers, from MQTT or the website
+        self.status = None
+        self.closetime = None
+        # monotonic time of the last news about the status, None if stale
+        self.updated = None
+        self.flush_timer = None
+
+    def last_status(self):
+        """Returns the announced status, read from .lastst the first time."""
+        with self.lock:
+            if self.announced is None:
+                try:
+                    self.announced = get_last_status()
+                except IOError:
+                    self.announced = CURRENT_STATUS
+            return self.announced
+
+    def set(self, status, closetime=None):
+        """Sets the status announced via MQTT."""
+        with self.lock:
+            self.announced = self.status = status
+            self.closetime = closetime
+            self.updated = time.monotonic()
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(PERSIST_DELAY, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def observe(self, status, closetime):
+        """Sets the status seen on the website, for !status only."""
+        with self.lock:
+            self.status = status
+            self.closetime = closetime
+            self.updated = time.monotonic()
+
+    def touch(self):
+        with self.lock:
+            self.updated = time.monotonic()
+
+    def set_closetime(self, closetime):
+        with self.lock:
+            self.closetime = closetime
+            self.updated = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self.flush_timer = None
+            status = self.announced
+        set_last_status(status)
+
+    def current(self, bot, config):
+        """Returns (status, closetime), asking the website when stale."""
+        ttl = float(config.get('status_ttl', STATUS_TTL)) if config else STATUS_TTL
+        with self.fetch_lock:
+            with self.lock:
+                if self.updated is not None and \
+                        time.monotonic() - self.updated < ttl:
+                    return self.status, self.closetime
+            http = bot.http_client(config)
+            try:
+                st = http.get(SPACESTATUS_URL).json()
+                closetime = None
+                if st['state']['open']:
+                    closetime = http.get(SPACEOPEN_URL).json().get('closetime')
+            except (requests.RequestException, ValueError, KeyError,
+                    TypeError, AttributeError) as e:
+                logging.warning('Could not fetch the space status: %s', e)
+                # better a stale status than none
+                with self.lock:
+                    status = self.status
+                return status or self.last_status(), self.closetime
+            # the announcements, .lastst and the history only follow MQTT
+            self.observe('offen' if st['state']['open'] else 'zu', closetime)
+            return self.status, self.closetime
+
+
+STATE = SpaceStatus()
+
+
+def days(start, end):
+    """Yields (local date, seconds) of the interval start to end per day."""
+    while start < end:
+        day = datetime.date.fromtimestamp(start)
+        midnight = datetime.datetime.combine(
+            day + datetime.timedelta(days=1), datetime.time()).timestamp()
+        yield day, min(end, midnight) - start
+        start = midnight
+
+
+class HistoryStore(object):
+    """Space status and doorbell events in an SQLite database.
+
+    Every event is kept in the events table. The daily table holds the
+    opening time and doorbell rings per (local) day, updated with every
+    event, so statistics over years only have to sum a few rows."""
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+
+    def open(self):
+        """Opens the database, once. Imports HISTORY_LOG into a new one."""
+        if self.db is not None:
+            return
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS events '
+                            '(ts REAL NOT NULL, topic TEXT NOT NULL, value TEXT)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS events_topic_ts '
+                            'ON events (topic, ts)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS daily '
+                            '(day TEXT PRIMARY KEY, '
+                            'open_secs REAL NOT NULL DEFAULT 0, '
+                            'rings INTEGER NOT NULL DEFAULT 0)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta '
+                            '(key TEXT PRIMARY KEY, value TEXT)')
+            if self.get_meta('log_imported') is None:
+                self.import_log(HISTORY_LOG)
+                self.set_meta('log_imported', time.time())
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                        (key, value))
+
+    def import_log(self, path):
+        """Adds the events of a spacehistory.log, in the open transaction."""
+        if not os.path.isfile(path):
+            return
+        imported = 0
+        with open(path, 'r', encoding='utf-8', errors='replace') as log:
+            for line in log:
+                match = HISTORY_LOG_RE.match(line.rstrip('\n'))
+                if match is None:
+                    continue
+                asctime, topic, value = match.groups()
+                ts = time.mktime(time.strptime(asctime, '%Y-%m-%d %H:%M:%S'))
+                if topic is None:
+                    if value not in ('offen', 'zu'):
+                        continue
+                    topic = STATUS_TOPIC
+                self.add(topic, value, ts)
+                imported += 1
+        logging.info('Imported %d events from %s', imported, path)
+
+    def add(self, topic, value, ts):
+        """Adds an event and updates the daily rollup, without commit."""
+        self.db.execute('INSERT INTO events (ts, topic, value) VALUES (?, ?, ?)',
+                        (ts, topic, value))
+        if topic == DOORBELL_TOPIC:
+            self.db.execute(
+                'INSERT INTO daily (day, rings) VALUES (?, 1) ON CONFLICT (day) '
+                'DO UPDATE SET rings = rings + 1',
+                (datetime.date.fromtimestamp(ts).isoformat(),))
+        elif topic == STATUS_TOPIC:
+            open_since = self.get_meta('open_since')
+            if value == 'offen' and open_since is None:
+                self.set_meta('open_since', ts)
+            elif value == 'zu' and open_since is not None:
+                for day, secs in days(float(open_since), ts):
+                    self.db.execute(
+                        'INSERT INTO daily (day, open_secs) VALUES (?, ?) '
+                        'ON CONFLICT (day) DO UPDATE SET '
+                        'open_secs = open_secs + excluded.open_secs',
+                        (day.isoformat(), secs))
+                self.db.execute("DELETE FROM meta WHERE key = 'open_since'")
+
+    def record(self, topic, value, ts=None):
+        with self.lock:
+            try:
+                self.open()
+                with self.db:
+                    self.add(topic, value, time.time() if ts is None else ts)
+            except sqlite3.Error:
+                logging.exception('Could not save %s to the space history', topic)
+
+    def weeks(self, count, now=None):
+        """Returns [(iso year, iso week, open seconds, rings)] of the last
+        count weeks, the current one included."""
+        now = time.time() if now is None else now
+        today = datetime.date.fromtimestamp(now)
+        first = today - datetime.timedelta(days=today.weekday(), weeks=count - 1)
+        with self.lock:
+            self.open()
+            rows = self.db.execute(
+                'SELECT day, open_secs, rings FROM daily WHERE day >= ?',
+                (first.isoformat(),)).fetchall()
+            open_since = self.get_meta('open_since')
+        totals = collections.OrderedDict()
+        for num in range(count):
+            year, week, _ = (first + datetime.timedelta(weeks=num)).isocalendar()
+            totals[year, week] = [0, 0]
+        if open_since is not None:
+            # the space is open right now
+            rows += [(day.isoformat(), secs, 0)
+                     for day, secs in days(max(float(open_since),
+                                               time.mktime(first.timetuple())),
+                                           now)]
+        for day, open_secs, rings in rows:
+            year, week, _ = datetime.date.fromisoformat(day).isocalendar()
+            if (year, week) in totals:
+                totals[year, week][0] += open_secs
+                totals[year, week][1] += rings
+        return [(year, week, secs, rings)
+                for (year, week), (secs, rings) in totals.items()]
+
+
+HISTORY = HistoryStore()
+
+
 def get_status(event, message, bot, args, config):
     """Erfahre, ob das Eigenbaukombinat gerade geöffnet ist."""
-    timestamp = datetime.datetime.now().isoformat()
-    st = requests.get('{}?{}'.format(SPACESTATUS_URL, timestamp)).json()
-
-    if st['state']['open']:
-        howlong = requests.get('{}?{}'.format(SPACEOPEN_URL, timestamp)).json()
-        if howlong.get('closetime') is not None:
-            status = 'bis mindestens {} Uhr offen'.format(howlong['closetime'])
-        else:
-            status = 'offen'
-    else:
-        status = 'zu'
+    status, closetime = STATE.current(bot, config)
+    if status == 'offen' and closetime is not None:
+        status = 'bis mindestens {} Uhr offen'.format(closetime)
 
     bot.reply(event, "<b>Der Space ist {}.</b>".format(status), html=True)
 
@@ -55,11 +286,26 @@ def set_status(event, message, bot, args, config):
     bot.reply(event, "Setze status auf %s. Nicht." % which)
 
 
+def history(event, message, bot, args, config):
+    """ [<i>wochen</i>] – Zeigt Öffnungsstunden und Klingeln der letzten Wochen."""
+    count = HISTORY_WEEKS
+    if args:
+        try:
+            count = max(1, min(int(args[0]), MAX_WEEKS))
+        except ValueError:
+            bot.reply(event, "Bitte eine Anzahl Wochen angeben.")
+            return
+    lines = ['<b>Der Space war in den letzten {} Wochen:</b>'.format(count)]
+    for year, week, secs, rings in reversed(HISTORY.weeks(count)):
+        hours = '{:.1f}'.format(secs / 3600).replace('.', ',')
+        lines.append('KW {}/{}: {} Stunden offen, {} mal geklingelt'.format(
+            week, year, hours, rings))
+    bot.reply(event, '<br/>'.join(lines), html=True)
+
+
 def _announce(bot, topic, msg):
     """Announce a msg of a topic to the subscribed rooms."""
-    for room in list(bot.client.rooms.values()):
-        if room.room_id in SUBS[topic]:
-            bot.send_html(room, msg)
+    bot.broadcast(topic, msg)
 
 
 def announce_status(message, data, client, bot, config):
@@ -73,13 +319,14 @@ def announce_status(message, data, client, bot, config):
     else:
         logging.info("Unknown payload: '{}'".format(payload))
         return
-    if status == get_last_status():
+    if status == STATE.last_status():
         # status did not change, this bug should be fixed in spacemaster...
         # also, this happens every time the door is locked after correctly closing the space via switch. (space close safetybelt)
         logging.info("Received Message, but status did not change. Possibly door the has been locked after switch has been correctly set to closed.")
+        STATE.touch()
         return
-    set_last_status(status)
-    shlog.info(status)
+    STATE.set(status)
+    HISTORY.record(STATUS_TOPIC, status)
 
     msg = '<b>Der Space ist jetzt {}.</b>'.format(status)
     _announce(bot, 'space/status/open', msg)
@@ -88,7 +335,9 @@ def announce_status(message, data, client, bot, config):
 
 def announce_generic(message, data, client, bot, config):
     payload = message.payload.decode('utf8')
-    shlog.info(f'{message.topic}: {payload}')
+    if message.topic == 'space/status/closetime':
+        STATE.set_closetime(payload)
+    HISTORY.record(message.topic, payload)
     logging.info(f"{message.topic} contained: {payload}")
     _announce(bot, message.topic, ROOM_MSGS[message.topic].format(payload))
 
@@ -101,9 +350,10 @@ def subscribe(event, message, bot, args, config):
     if topic not in MSGS:
         bot.reply(event, "Unbekanntes topic.")
         return
-    SUBS[topic].append(event['room_id'])
+    if not bot.subscriptions.subscribe(topic, event['room_id']):
+        bot.reply(event, f"Das Thema {topic} ist in diesem Raum bereits abonniert.")
+        return
     bot.reply(event, f"Das Thema {topic} wurde in diesem Raum abonniert.")
-    save_subscriptions()
 
 def unsubscribe(event, message, bot, args, config):
     """ <i>thema</i> (z.B. <i>space/status/klingel</i>) – Beendet ein Abo für das angegebene Thema für einen Raum."""
@@ -113,33 +363,21 @@ def unsubscribe(event, message, bot, args, config):
     if topic not in MSGS:
         bot.reply(event, "Unbekanntes topic.")
         return
-    if event['room_id'] not in SUBS[topic]:
-        bot.reply(event, "Abo für das Thema {topic} in diesem Raum nicht gefunden.")
+    if not bot.subscriptions.unsubscribe(topic, event['room_id']):
+        bot.reply(event, f"Abo für das Thema {topic} in diesem Raum nicht gefunden.")
         return
-    del SUBS[topic][SUBS[topic].index(event['room_id'])]
     bot.reply(event, f"Das Abo für das Thema {topic} wurde in diesem Raum beendet.")
-    save_subscriptions()
 
 def list_subscriptions(event, message, bot, args, config):
     """Zeigt die aktuelle abonnierten Themen in einem Raum an."""
-    topics = []
-    for topic, rooms in SUBS.items():
-        if event['room_id'] in rooms:
-            topics.append(topic)
+    topics = [topic for topic in bot.subscriptions.subscribed(event['room_id'])
+              if topic in MSGS]
     bot.reply(event, f"In diesem Raum sind folgende Themen abonniert: {', '.join(topics)}")
 
 
-def save_subscriptions():
-    """Saves the subscriptions to a file."""
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        temp_file.write(json.dumps(SUBS).encode())
-        temp_file_path = temp_file.name
-
-    shutil.move(temp_file_path, '.subscriptions')
-
-
 CMDS = {'!status': get_status,
         '!setstatus': set_status,
+        '!history': history,
         '!subscribe': subscribe,
         '!unsubscribe': unsubscribe,
         '!list_subscriptions': list_subscriptions, }
@@ -160,17 +398,3 @@ ROOM_MSGS = {
          'space/status/error': '<b>FEHLER:</b><br/><i>{}</i>',
          'space/status/door': '<b>Tuerstatus: {}</b>'}
 
-
-
-SUBS = { msg: [] for msg in MSGS }
-
-def load_subscriptions():
-    if not os.path.isfile('.subscriptions'):
-        return
-    with open('.subscriptions', 'r') as subfile:
-        subs = json.loads(subfile.read())
-        for topic, rooms in subs.items():
-            if topic in SUBS and isinstance(rooms, list):
-                SUBS[topic] = rooms
-
-load_subscriptions()
@@ -1,11 +1,17 @@
 
 
+import collections
 import datetime
+import functools
 import requests
 import logging
 import os
 import json
 import hashlib
+import threading
+
+# rewrite the voting file after this many journaled votes
+COMPACT_EVERY = 100
 
 
 class Voting(object):
@@ -14,30 +20,75 @@ class Voting(object):
         self.question = question
         self.answers = answers
         self.votes = dict()
+        # answer -> number of votes, kept up to date by apply
+        self.tally = collections.Counter()
+        self.journaled = 0
         self.mode = mode
         self.room = room
 
     @classmethod
     def from_file(klass, filehandle):
-        """construct instance from saved data."""
+        """construct instance from saved data and replay the journal."""
         fdata = filehandle.read()
         if not fdata:
             return
         data = json.loads(fdata)
-        instance = klass(data['room'], data['question'], *data['answers'])
-        instance.votes = data['votes']
+        instance = klass(data['room'], data['question'], *data['answers'],
+                         mode=data.get('mode', 'multi'))
+        for uid, choices in data['votes'].items():
+            instance.apply(uid, choices)
+        instance.replay_journal()
         return instance
 
+    def journal_file(self):
+        return f'voting_{self.room}.journal'
+
+    def replay_journal(self):
+        if not os.path.isfile(self.journal_file()):
+            return
+        with open(self.journal_file()) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # e.g. a line cut off by a crash
+                    continue
+                self.apply(entry['uid'], entry['choices'])
+                self.journaled += 1
+
     def save(self):
-        """Save data to file."""
+        """Save all data to file and start a new journal."""
         fn = f'voting_{self.room}.json'
-        with open(fn, 'w') as votedata:
+        with open(fn + '.tmp', 'w') as votedata:
             votedata.write(json.dumps({
                 'room': self.room,
                 'question': self.question,
                 'answers': self.answers,
+                'mode': self.mode,
                 'votes': self.votes
                 }))
+        os.replace(fn + '.tmp', fn)
+        if os.path.isfile(self.journal_file()):
+            os.unlink(self.journal_file())
+        self.journaled = 0
+
+    def record(self, uid):
+        """Append the vote of uid to the journal, compacting it now and then."""
+        if self.journaled >= COMPACT_EVERY:
+            self.save()
+            return
+        with open(self.journal_file(), 'a') as journal:
+            journal.write(json.dumps(
+                {'uid': uid, 'choices': self.votes[uid]}) + '\n')
+        self.journaled += 1
+
+    def apply(self, uid, choices):
+        """Set the vote of uid, updating the tally."""
+        old = self.votes.get(uid)
+        if old:
+            self.tally.subtract(old)
+        self.tally.update(choices)
+        self.votes[uid] = choices
 
     def vote(self, uid, choice):
         if self.mode == 'single' and ',' in choice:
@@ -53,52 +104,99 @@ class Voting(object):
         for choice in choices:
             if choice.strip() not in self.answers:
                 return f'{choice} is not a valid choice. Type !vote without anything to see the options.'
-        self.votes[uid] = [c.strip() for c in choices]
+        self.apply(uid, [c.strip() for c in choices])
 
     def total_votes(self):
         return len(self.votes.keys())
 
     def results_total(self, answer):
         """the number of votes on speficied answer"""
-        count = 0
-        for uid, votes in self.votes.items():
-            for vote in votes:
-                if vote == answer:
-                    count += 1
-        return count
+        return self.tally[answer]
+
+
+class VotingStore(object):
+    """Votings of the rooms, the recently used ones kept in memory.
+
+    Idle votings are written back to disk when more than max_cached are
+    in memory. Rooms known to have no voting are remembered as well, so
+    they do not cost a file system lookup every time."""
+
+    def __init__(self, max_cached=64, max_negative=1024):
+        self.lock = threading.Lock()
+        self.max_cached = max_cached
+        self.max_negative = max_negative
+        # room key -> Voting, least recently used first
+        self.votings = collections.OrderedDict()
+        # room keys without a voting, least recently used first
+        self.no_voting = collections.OrderedDict()
+
+    def get(self, room):
+        with self.lock:
+            voting = self.votings.get(room)
+            if voting is not None:
+                self.votings.move_to_end(room)
+                return voting
+            if room in self.no_voting:
+                self.no_voting.move_to_end(room)
+                return None
+            fn = f'voting_{room}.json'
+            #try to load from file
+            if os.path.isfile(fn):
+                with open(fn) as voting_data_file:
+                    voting = Voting.from_file(voting_data_file)
+            if voting is None:
+                self.no_voting[room] = True
+                if len(self.no_voting) > self.max_negative:
+                    self.no_voting.popitem(last=False)
+                return None
+            self.cache(room, voting)
+            return voting
+
+    def cache(self, room, voting):
+        self.no_voting.pop(room, None)
+        self.votings[room] = voting
+        while len(self.votings) > self.max_cached:
+            evicted_room, evicted = self.votings.popitem(last=False)
+            evicted.save()
+
+    def start(self, room, voting):
+        with self.lock:
+            voting.save()
+            self.cache(room, voting)
+
+    def remove(self, room):
+        with self.lock:
+            voting = self.votings.pop(room, None)
+            self.no_voting[room] = True
+            if len(self.no_voting) > self.max_negative:
+                self.no_voting.popitem(last=False)
+            for fn in (f'voting_{room}.json', f'voting_{room}.journal'):
+                if os.path.isfile(fn):
+                    os.unlink(fn)
+
+
+VOTINGS = VotingStore()
 
 
 def get_current_voting(bot, room):
-    if not hasattr(bot, 'VOTINGS'):
-        bot.VOTINGS = dict()
-    voting = bot.VOTINGS.get(room)
-    if voting is None:
-        fn = f'voting_{room}.json'
-        #try to load from file
-        if os.path.isfile(fn):
-            with open(fn) as voting_data_file:
-                bot.VOTINGS[room] = voting_from_file = Voting.from_file(voting_data_file)
-            return voting_from_file
-    return voting
+    return VOTINGS.get(room)
 
 def start_voting(bot, room, question, answers):
-    bot.VOTINGS[room] = voting = Voting(room, question, *answers)
-    voting.save()
+    VOTINGS.start(room, Voting(room, question, *answers))
 
 
 def reset_voting(bot, room):
-    del bot.VOTINGS[room]
-    fn = f'voting_{room}.json'
-    if os.path.isfile(fn):
-        os.unlink(fn)
+    VOTINGS.remove(room)
+
+@functools.lru_cache(maxsize=4096)
+def hash_key(value):
+    return hashlib.sha224(value.encode('utf8')).hexdigest()
 
 def get_room_key(event):
-    room = event.get('room_id')
-    return hashlib.sha224(room.encode('utf8')).hexdigest()
+    return hash_key(event.get('room_id'))
 
 def get_user_key(event):
-    user = event['sender']
-    return hashlib.sha224(user.encode('utf8')).hexdigest()
+    return hash_key(event['sender'])
 
 
 def vote(event, message, bot, args, config):
@@ -120,10 +218,10 @@ def vote(event, message, bot, args, config):
         bot.reply(event, reply)
         return
     result = current_voting.vote(sender, msg)
-    current_voting.save()
     if result is not None:
         bot.reply(event, result)
         return
+    current_voting.record(sender)
     bot.reply(event, 'Your vote has been counted.')
 
 def startvote(event, message, bot, args, config):
@@ -1,14 +1,20 @@
 import json
 import html
+import concurrent.futures
+import logging
 from contextlib import suppress
 import requests
 
+# ids of the notifications handled already, loaded from ./seen_ids once
+SEEN_IDS = None
 
 
 def get_seen_ids():
-    with open("./seen_ids") as seen_file:
-        content = seen_file.read()
-    return set(content.strip().split("\n"))
+    with suppress(FileNotFoundError):
+        with open("./seen_ids") as seen_file:
+            content = seen_file.read()
+        return set(content.strip().split("\n"))
+    return set()
 
 
 def write_seen_ids(ids):
@@ -17,26 +23,24 @@ def write_seen_ids(ids):
         seen_file.write(content)
 
 
-def zammad_get(url, config):
-    response = requests.get(
-        url=config["url"] + url,
+def zammad_get(bot, url, config):
+    response = bot.http_client(config).get(
+        config["url"] + url,
         headers={"Authorization": 'Bearer %s' % config["token"]},
     )
     return response.json()
 
 
-def get_unread_notifications(config):
-    response = zammad_get("/api/v1/online_notifications", config)
+def get_unread_notifications(bot, config):
+    response = zammad_get(bot, "/api/v1/online_notifications", config)
     return [n for n in response if n["seen"] is False]
 
 
 def send_notification(bot, ticket, ticket_id, config):
-    found = False
-    for room_id in bot.client.rooms:
-        room = bot.client.rooms[room_id]
-        if room.display_name == config['room']:
-            found = True
-            break
+    room = bot.directory.get(config['room'])
+    if room is None:
+        logging.error('Zammad room %s not found.', config['room'])
+        return
     # cook quote and send to room
     ticket_from = html.escape(ticket["from"]) 
     subj = html.escape(ticket["subject"])
@@ -46,20 +50,43 @@ def send_notification(bot, ticket, ticket_id, config):
     bot.send_html(room, txt)
 
 
+def get_first_article(bot, notification, config):
+    """Returns the first article of the notification's ticket, or None."""
+    try:
+        return zammad_get(bot, '/api/v1/ticket_articles/by_ticket/%s'
+                          % notification["o_id"], config)[0]
+    except (requests.RequestException, ValueError, IndexError, KeyError) as e:
+        logging.warning('Could not fetch ticket %s from zammad: %s',
+                        notification["o_id"], e)
+        return None
+
+
 def check_zammad(bot, config):
     """holt notifications vom zammad und postet sie in einen raum"""
-    seen_ids = get_seen_ids()
-    notifications = get_unread_notifications(config)
-    new_seen_ids = set() 
-    for notification in notifications:
-        ticket_id = notification["o_id"]
-        ticket = zammad_get('/api/v1/ticket_articles/by_ticket/%s' % ticket_id, config)[-0]
-        if ticket["to"] != config["addr"]:
-            continue
-        if str(notification["id"]) not in seen_ids:
-            send_notification(bot, ticket, ticket_id, config)
-        new_seen_ids.add(notification["id"])
-    write_seen_ids(new_seen_ids.union(seen_ids))
+    global SEEN_IDS
+    if SEEN_IDS is None:
+        SEEN_IDS = get_seen_ids()
+    notifications = get_unread_notifications(bot, config)
+    new = [n for n in notifications if str(n["id"]) not in SEEN_IDS]
+    # forget notifications which are not unread anymore
+    seen_ids = SEEN_IDS & {str(n["id"]) for n in notifications}
+    changed = seen_ids != SEEN_IDS
+    if new:
+        workers = min(len(new), int(config.get("fetch_workers", 4)))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            tickets = list(pool.map(
+                lambda n: get_first_article(bot, n, config), new))
+        for notification, ticket in zip(new, tickets):
+            if ticket is None:
+                # try again on the next check
+                continue
+            if ticket["to"] == config["addr"]:
+                send_notification(bot, ticket, notification["o_id"], config)
+            seen_ids.add(str(notification["id"]))
+            changed = True
+    SEEN_IDS = seen_ids
+    if changed:
+        write_seen_ids(SEEN_IDS)
 
 
 CRON = check_zammad